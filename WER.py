@@ -1,31 +1,92 @@
 # for getting the word & character error rates of generated lyrics compared to provided ones
-from jiwer import wer, cer
+import argparse
 import os
-import re
+from concurrent.futures import ProcessPoolExecutor
+import transcripts
+from normalization import normalize
+from corpus_store import CorpusStore, CORPUS_PATH, LEGACY_FOLDER
+
+# normalized reference lyrics keyed by (path, modification time), so each reference is cleaned once per process
+_REFERENCES = {}
+
+def levenshtein(source, target):
+    """
+    Edit distance between two sequences of hashable symbols with Myers' bit-parallel algorithm
+    (Hyyrö's formulation): one column of the DP matrix is kept as bit vectors, so every symbol of
+    the target costs a handful of integer operations on len(source)-bit Python ints.
+    """
+    if not source:
+        return len(target)
+    if not target:
+        return len(source)
+    peq = {}
+    for i, symbol in enumerate(source):
+        peq[symbol] = peq.get(symbol, 0) | (1 << i)
+    mask = (1 << len(source)) - 1
+    last = 1 << (len(source) - 1)
+    pv, mv, distance = mask, 0, len(source)
+    for symbol in target:
+        eq = peq.get(symbol, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            distance += 1
+        elif mh & last:
+            distance -= 1
+        ph = (ph << 1) | 1
+        mh <<= 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+    return distance
+
+def error_counts(original_text, generated_text):
+    """
+    Word and character edit distances of a transcript against its reference in one call.
+
+    Returns:
+        tuple: (word edits, reference words, character edits, reference characters)
+    """
+    original_words = original_text.split()
+    generated_words = generated_text.split()
+    # characters are compared on the whitespace-collapsed text, like jiwer's default transforms
+    original_chars = " ".join(original_words)
+    generated_chars = " ".join(generated_words)
+    return (levenshtein(original_words, generated_words), len(original_words),
+            levenshtein(original_chars, generated_chars), len(original_chars))
 
 def calculate_wer(original_text, generated_text):
     # Calculate Word Error Rate (WER) and Character Error Rate (CER) between two texts.
-
-    word_error_rate = wer(original_text, generated_text)
-    char_error_rate = cer(original_text, generated_text)
+    word_edits, words, char_edits, chars = error_counts(original_text, generated_text)
+    word_error_rate = word_edits / words if words else float(word_edits > 0)
+    char_error_rate = char_edits / chars if chars else float(char_edits > 0)
     return (word_error_rate, char_error_rate)
 
-def load_original(folder_path='original_lyrics'): # return dict of dict of lyrics
+def load_reference(file_path):
+    """Normalized reference lyrics of one file (URL and blank line skipped), cached per file version."""
+    key = (file_path, os.stat(file_path).st_mtime_ns)
+    if key not in _REFERENCES:
+        with open(file_path, encoding="utf-8") as f:
+            lines = f.readlines()[2:] # skip link and empty line
+        _REFERENCES[key] = normalize("".join(lines))
+    return _REFERENCES[key]
+
+def load_original(folder_path=None, store_path=CORPUS_PATH): # return dict of dict of lyrics
+    # a folder asked for explicitly wins; otherwise the corpus store (references already normalized) when there is one,
+    # else the legacy folder
+    if folder_path is None and os.path.isfile(store_path):
+        with CorpusStore(store_path, readonly=True) as store:
+            songs = {key: {'original': normalized} for key, normalized in store.references().items()}
+        print("Extraced lyrics.")
+        return songs
+    folder_path = folder_path or LEGACY_FOLDER
     try:
         # Get a list of all files in the folder
         files = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
         songs = {}
         for fname in files:
-            file_path = os.path.join(folder_path, fname)
-            with open(file_path) as f:
-                lines = f.readlines()
-                cleaned_lines = []
-                lines = lines[2:] # skip link and empty line
-                for line in lines:
-                    line = re.sub(r"[.,!?]", "", line) # Remove punctuation
-                    cleaned_lines.append(line.strip())
-                lyrics = {'original': " ".join(cleaned_lines)}
-                songs[fname.split('.txt')[0]] = lyrics
+            songs[fname.split('.txt')[0]] = {'original': load_reference(os.path.join(folder_path, fname))}
         print("Extraced lyrics.")
         return songs
     except FileNotFoundError:
@@ -34,59 +95,88 @@ def load_original(folder_path='original_lyrics'): # return dict of dict of lyric
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         return {}
-    
-def load_lyrics(folder_path='original_lyrics', models = ['small','turbo','large']):
-    songs = load_original(folder_path)
-    scores = []
-    for fname, lyrics in songs.items():
-        model_scores = {}
-        try:
-            for model in models:
-                with open(os.path.join('lyric_results', f'{fname}_({model}).txt')) as f:
-                    lines = f.readlines()
-                cleaned_lines = []
-                for line in lines:
-                    
-                    line = re.sub(r"\[.*?\]", "", line) # Remove timestamps
-                    line = re.sub(r"[.,!?]", "", line) # Remove punctuation
-                    cleaned_lines.append(line.strip()) # strip leading/trailing whitespace
 
-                lyrics[model] = " ".join(cleaned_lines)
-            # if fname == 'Ritchie Valens - Donna':
-            #     print(lyrics['original'])
-            #     print()
-            #     print(lyrics['small'])
-            #     print()
-            #     print(lyrics['turbo'])
-            #     print()
-            #     return
-            for model in models:
-                word_e, char_e = calculate_wer(lyrics['original'],lyrics[model])
-                model_scores[model] = (word_e, char_e)
-            scores.append((fname,model_scores))
-        except FileNotFoundError:
-            print(f"load_lyrics Error: The location '{os.path.join('lyric_results', fname)}' does not exist.")
-            return
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
-            return
+def _score_song(task):
+    # runs in a pool worker: every model's transcript of one song against the song's reference
+    fname, original, models, results_dir = task
+    counts, missing = {}, []
+    for model in models:
+        path = os.path.join(results_dir, f'{fname}_({model}).txt')
+        if not (os.path.isfile(path) or os.path.isfile(transcripts.jsonl_path(path))):
+            missing.append(model)
+            continue
+        # JSONL transcript when there is one, else the text view (timestamps are parsed off)
+        generated = normalize("\n".join(segment['text'] for segment in transcripts.load_segments(path)))
+        counts[model] = error_counts(original, generated)
+    return fname, counts, missing
 
-    return scores
+def evaluate(folder_path=None, models=('small', 'turbo', 'large'), results_dir='lyric_results', workers=None,
+             store_path=CORPUS_PATH, names=None):
+    """
+    Score every model's transcripts against the reference lyrics, spreading the songs over a process pool.
 
-if __name__ == "__main__":
-    # original = "this is a sample text to evaluate word error rate of this text"
-    # generated = "this is sample text evaluate the error rate of this text"
+    Args:
+        folder_path (str): Folder of the reference lyrics; None reads the corpus store, or original_lyrics without one.
+        models (tuple): Models whose transcripts to score.
+        results_dir (str): Folder of the transcripts.
+        workers (int): Worker processes, defaults to the number of CPUs.
+        store_path (str): Corpus store holding the references.
+        names (iterable): Only score these songs, every song of the corpus when None.
+    Returns:
+        dict: 'songs' (song -> model -> (WER, CER)), 'corpus' (model -> 'wer', 'cer', 'songs') and
+              'missing' (song -> models without a transcript); songs with missing transcripts are skipped, not fatal.
+    """
+    songs = load_original(folder_path, store_path)
+    if names is not None:
+        names = set(names)
+        songs = {fname: lyrics for fname, lyrics in songs.items() if fname in names}
+    tasks = [(fname, lyrics['original'], tuple(models), results_dir) for fname, lyrics in sorted(songs.items())]
+    report = {'songs': {}, 'corpus': {}, 'missing': {}}
+    totals = {model: [0, 0, 0, 0] for model in models}
 
-    # word_error_rate, char_error_rate = calculate_wer(original, generated)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # songs are cheap individually, so they are handed to the workers in chunks
+        chunksize = max(1, len(tasks) // (4 * (workers or os.cpu_count() or 1)))
+        for fname, counts, missing in pool.map(_score_song, tasks, chunksize=chunksize):
+            if missing:
+                report['missing'][fname] = missing
+                print(f"load_lyrics Error: no {', '.join(missing)} transcript for '{fname}', skipped.")
+            song_scores = {}
+            for model, (word_edits, words, char_edits, chars) in counts.items():
+                song_scores[model] = (word_edits / words if words else float(word_edits > 0),
+                                      char_edits / chars if chars else float(char_edits > 0))
+                for i, value in enumerate((word_edits, words, char_edits, chars)):
+                    totals[model][i] += value
+            if song_scores:
+                report['songs'][fname] = song_scores
 
-    # print("=== Error Rates ===")
-    # print(f"Word Error Rate (WER): {word_error_rate:.2%}")
-    # print(f"Character Error Rate (CER): {char_error_rate:.2%}")
+    for model, (word_edits, words, char_edits, chars) in totals.items():
+        scored = sum(model in scores for scores in report['songs'].values())
+        if scored:
+            # corpus rates weight every song by its length, unlike the mean of per-song rates
+            report['corpus'][model] = {'wer': word_edits / words if words else 0.0,
+                                       'cer': char_edits / chars if chars else 0.0, 'songs': scored}
+    return report
+
+def load_lyrics(folder_path=None, models = ['small','turbo','large']):
+    # per-song scores as (song, {model: (WER, CER)}) pairs
+    return list(evaluate(folder_path, models)['songs'].items())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Word and character error rates of the transcripts against the original lyrics.")
+    references = parser.add_mutually_exclusive_group()
+    references.add_argument("--folder", type=str, default=None, help="folder of the reference lyrics, instead of the corpus store")
+    references.add_argument("--store", type=str, default=CORPUS_PATH, help="corpus store of the reference lyrics")
+    parser.add_argument("--models", type=str, nargs="*", default=["small", "turbo", "large"], help="models to score")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    args = parser.parse_args()
 
-    scores = load_lyrics()
-    sorted_scores = scores.sort(key = lambda tup: tup[0]) # sort by name
+    report = evaluate(args.folder, args.models, workers=args.workers, store_path=args.store)
     print("=== Error Rates ===")
-    for song, model_scores in scores:
+    for song, model_scores in report['songs'].items():
         for model, score in model_scores.items():
             print(f'{song} ({model}) ---> WER: {score[0]:.2f}, CER: {score[1]:.2f}')
-        print('\n')
\ No newline at end of file
+        print('\n')
+    print("=== Corpus ===")
+    for model, stats in report['corpus'].items():
+        print(f"{model:<8} songs: {stats['songs']:<5} WER: {stats['wer']:.3f}  CER: {stats['cer']:.3f}")
@@ -10,7 +10,7 @@ def generate_image_with_dalle(art_prompt, client, output_dir):
         final_prompt = f"{main_prompt} Style: {style}"
 
         # Generate image with DALL-E
-        response = client.images.generate(
+        response = client.generate_image(
             model="dall-e-3",
             prompt=final_prompt,
             size="1024x1024",
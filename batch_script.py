@@ -0,0 +1,133 @@
+# for running the pipeline over a whole catalog of songs with a pool of warm worker processes
+import glob
+import multiprocessing
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a', '.ogg')
+MANIFEST_EXTENSIONS = ('.txt', '.lst', '.m3u', '.m3u8')
+
+# per-process state of a pool worker, kept warm between songs
+_worker_args = None
+_worker_client = None
+
+def is_batch_target(target):
+    """Whether the target names a directory, a glob pattern or a manifest rather than one song."""
+    if os.path.isdir(target):
+        return True
+    if any(ch in target for ch in '*?['):
+        return not os.path.isfile(target)
+    return target.lower().endswith(MANIFEST_EXTENSIONS)
+
+def collect_songs(target):
+    """
+    Expand a directory, glob pattern or manifest file into a list of song paths.
+
+    Args:
+        target (str): Directory of audio files, glob pattern, or manifest with one path per line.
+    Returns:
+        list: Sorted paths of the songs to process.
+    """
+    if os.path.isdir(target):
+        songs = [os.path.join(target, f) for f in os.listdir(target) if f.lower().endswith(AUDIO_EXTENSIONS)]
+    elif target.lower().endswith(MANIFEST_EXTENSIONS) and os.path.isfile(target):
+        base_dir = os.path.dirname(target)
+        songs = []
+        with open(target, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'): # skip blank lines and comments
+                    continue
+                songs.append(line if os.path.isabs(line) else os.path.join(base_dir, line))
+    else:
+        songs = [f for f in glob.glob(target, recursive=True) if f.lower().endswith(AUDIO_EXTENSIONS)]
+
+    missing = [song for song in songs if not os.path.isfile(song)]
+    for song in missing:
+        print(f"Error: File not found: {song}")
+    return sorted(song for song in songs if song not in missing)
+
+def _init_worker(args):
+    # runs once per worker process; models loaded by the stages stay resident for the following songs
+    global _worker_args, _worker_client
+    if not args.warnings:
+        warnings.filterwarnings("ignore")
+    import main
+    _worker_args = args
+    # the API budgets are split evenly so the whole pool stays within the account's limits
+    _worker_client = main.make_client(budget_share=1 / max(1, args.workers), cache_mode=args.llm_cache) if args.depth > 1 else None
+
+def _run_one(file):
+    import main
+    try:
+        return main.run_song(file, _worker_args, _worker_client)
+    except Exception as e:
+        return {'song': file, 'status': 'error', 'timings': {}, 'errors': [str(e)]}
+
+def run_batch(songs, args):
+    """
+    Run the pipeline over every song, spreading them across args.workers processes.
+
+    Args:
+        songs (list): Paths of the songs to process.
+        args (argparse.Namespace): Parsed command-line options shared by every song.
+    Returns:
+        list: Per-song reports as returned by main.run_song.
+    """
+    workers = max(1, min(args.workers, len(songs)))
+    if workers > 1 and args.threads is None:
+        # every worker gets its share of the cores instead of each torch spawning a thread per core
+        args.threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"\n\nBatch: {len(songs)} songs on {workers} worker(s)")
+    reports = []
+    start = time.time()
+
+    if workers == 1:
+        _init_worker(args)
+        for song in songs:
+            reports.append(_run_one(song))
+            print_status(reports[-1], len(reports), len(songs))
+    else:
+        # spawn rather than fork so CUDA and the HuggingFace tokenizers start cleanly in every worker
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(args,)) as pool:
+            futures = {pool.submit(_run_one, song): song for song in songs}
+            for future in as_completed(futures):
+                try:
+                    report = future.result()
+                except Exception as e: # a worker died
+                    report = {'song': futures[future], 'status': 'error', 'timings': {}, 'errors': [str(e)]}
+                reports.append(report)
+                print_status(report, len(reports), len(songs))
+
+    print_summary(reports, time.time() - start)
+    return reports
+
+def print_status(report, done, total):
+    """Print the one-line status of a finished song."""
+    elapsed = report.get('elapsed', 0.0)
+    line = f"[{done}/{total}] {report['status']:<5} {report['song']} ({elapsed:.1f}s)"
+    if report['errors']:
+        line += f" - {report['errors'][0]}"
+    print(line)
+
+def print_summary(reports, wall_time):
+    """Print throughput and per-stage latency percentiles of a finished batch."""
+    import numpy as np
+    succeeded = [r for r in reports if r['status'] == 'ok']
+    songs_per_min = len(succeeded) / (wall_time / 60) if wall_time > 0 else 0.0
+
+    print("\n=== Batch Complete ===")
+    print(f"songs: {len(reports)}, succeeded: {len(succeeded)}, failed: {len(reports) - len(succeeded)}")
+    print(f"wall time: {wall_time:.1f}s, throughput: {songs_per_min:.2f} songs/min")
+
+    stages = {}
+    for report in reports:
+        for stage, seconds in report['timings'].items():
+            stages.setdefault(stage, []).append(seconds)
+    for stage, values in stages.items():
+        p50, p95 = np.percentile(values, [50, 95])
+        print(f"{stage:<20} n={len(values):<4} p50: {p50:.2f}s  p95: {p95:.2f}s")
@@ -0,0 +1,198 @@
+# for choosing a Whisper model: speed, memory and accuracy of every model size over the original_lyrics corpus
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import warnings
+import WER
+from batch_script import AUDIO_EXTENSIONS
+
+RESULTS_DIR = "benchmark_results"
+
+def find_songs(folder_path=None, audio_dir='songs', limit=None):
+    """
+    Pair every reference in the corpus with its audio file ("<artist> - <album>.<ext>" in audio_dir).
+
+    Returns:
+        list: (name, audio path) pairs, sorted by name; references without audio are skipped.
+    """
+    audio = {}
+    for f in os.listdir(audio_dir):
+        name, ext = os.path.splitext(f)
+        if ext.lower() in AUDIO_EXTENSIONS:
+            audio[name] = os.path.join(audio_dir, f)
+    songs = []
+    for name in sorted(WER.load_original(folder_path)): # the folder when given, else the corpus store when there is one
+        if name in audio:
+            songs.append((name, audio[name]))
+        else:
+            print(f"No audio for '{name}', skipped.")
+    return songs[:limit] if limit else songs
+
+def peak_rss_mb():
+    """Peak resident memory of this process in megabytes, None when the platform can't tell."""
+    try:
+        import resource # Unix only
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        # only Windows reports a peak (its working set); elsewhere psutil knows just the current RSS
+        peak = getattr(psutil.Process().memory_info(), 'peak_wset', None)
+        return peak / (1024 * 1024) if peak is not None else None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux and the BSDs
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _run_model(model_name, songs, out_dir, device, dtype, threads, vad):
+    # runs in a fresh process per model, so the peak RSS belongs to that model alone
+    import whisper_script
+    from decoded_audio import DecodedAudio
+    from transcripts import SegmentWriter
+
+    device, dtype = whisper_script.resolve_device(device, dtype)
+    start = time.time()
+    whisper_script.get_model(model_name, device=device, dtype=dtype)
+    load_time = time.time() - start
+
+    audio_seconds = transcribe_seconds = 0.0
+    for name, path in songs:
+        # decoding and resampling are not part of the model's time (run_benchmark already cached both)
+        audio = DecodedAudio.load(path)
+        audio.for_whisper()
+        start = time.time()
+        base = os.path.join(out_dir, f"{name}_({model_name})")
+        with SegmentWriter(f"{base}.jsonl", text_path=f"{base}.txt") as writer:
+            whisper_script.transcribe_audio(path, model_name=model_name, device=device, dtype=dtype, audio=audio,
+                                            vad=vad, num_threads=threads, on_segment=writer.write)
+        transcribe_seconds += time.time() - start
+        audio_seconds += audio.duration
+        print(f"{model_name}: {name} ({audio.duration:.0f}s audio)")
+
+    return {'model': model_name, 'device': device, 'dtype': dtype, 'threads': threads, 'vad': vad,
+            'songs': len(songs), 'load_seconds': load_time, 'audio_seconds': audio_seconds,
+            'transcribe_seconds': transcribe_seconds,
+            'rtf': transcribe_seconds / audio_seconds if audio_seconds else None, 'peak_rss_mb': peak_rss_mb()}
+
+def pareto_front(results, keys=('rtf', 'wer')):
+    """Models no other model beats on every key (lower is better) and strictly on at least one."""
+    scored = [r for r in results if all(r.get(key) is not None for key in keys)]
+    front = []
+    for r in scored:
+        dominated = any(all(o[key] <= r[key] for key in keys) and any(o[key] < r[key] for key in keys)
+                        for o in scored if o is not r)
+        if not dominated:
+            front.append(r['model'])
+    return front
+
+def run_benchmark(models, folder_path=None, audio_dir='songs', out_dir=RESULTS_DIR, device="auto",
+                  dtype="auto", threads=None, vad=False, limit=None, workers=None):
+    """
+    Benchmark each model in its own subprocess, then score its transcripts with WER.evaluate.
+
+    Args:
+        models (list): Whisper models to compare.
+        folder_path (str): Folder of the reference lyrics; None reads the corpus store, or original_lyrics without one.
+        audio_dir (str): Folder of the songs' audio files.
+        out_dir (str): Folder for the transcripts and results.json.
+        device (str): Device to run on.
+        dtype (str): Weight precision.
+        threads (int): Torch CPU threads in the model processes.
+        vad (bool): Use the VAD-gated transcription.
+        limit (int): Benchmark only the first songs of the corpus.
+        workers (int): Worker processes of the WER scoring.
+    Returns:
+        list: Per model: load time, realtime factor, peak RSS, corpus WER/CER and whether it is on the Pareto front.
+    """
+    songs = find_songs(folder_path, audio_dir, limit)
+    if not songs:
+        print(f"Error: No songs of '{folder_path or 'the corpus'}' found in '{audio_dir}'")
+        return []
+    transcripts_dir = os.path.join(out_dir, "transcripts")
+    os.makedirs(transcripts_dir, exist_ok=True)
+    songs_file = os.path.join(out_dir, "songs.json")
+    with open(songs_file, 'w', encoding='utf-8') as f:
+        json.dump(songs, f, ensure_ascii=False)
+
+    # fill the decoded-audio cache (native rate and 16 kHz) once, so no model process pays for decoding or resampling
+    from decoded_audio import DecodedAudio
+    for name, path in songs:
+        DecodedAudio.load(path).for_whisper()
+
+    results = []
+    for model_name in models:
+        print(f"\n=== Benchmarking {model_name} on {len(songs)} song(s) ===")
+        result_file = os.path.join(out_dir, f"{model_name}.run.json")
+        if os.path.isfile(result_file): # left by an earlier run
+            os.remove(result_file)
+        command = [sys.executable, os.path.abspath(__file__), "--worker", model_name, "--songs-file", songs_file,
+                   "--out", out_dir, "--device", device, "--dtype", dtype]
+        if threads:
+            command += ["--threads", str(threads)]
+        if vad:
+            command.append("--vad")
+        if subprocess.run(command).returncode != 0 or not os.path.isfile(result_file):
+            print(f"Error: benchmark of {model_name} failed")
+            results.append({'model': model_name, 'error': 'run failed'})
+            continue
+        with open(result_file, encoding='utf-8') as f:
+            result = json.load(f)
+
+        # only this run's songs: transcripts left by earlier runs (another --limit) must not count
+        report = WER.evaluate(folder_path, [model_name], results_dir=transcripts_dir, workers=workers,
+                              names=[name for name, _ in songs])
+        corpus = report['corpus'].get(model_name, {})
+        result['wer'] = corpus.get('wer')
+        result['cer'] = corpus.get('cer')
+        results.append(result)
+
+    front = pareto_front(results)
+    for result in results:
+        result['pareto'] = result['model'] in front
+    with open(os.path.join(out_dir, "results.json"), 'w', encoding='utf-8') as f:
+        json.dump({'created': time.time(), 'songs': len(songs), 'results': results}, f, indent=2)
+    return results
+
+def print_summary(results):
+    print("\n=== Benchmark Summary ===")
+    print(f"{'model':<8} {'load':>7} {'RTF':>7} {'RSS (MB)':>10} {'WER':>7} {'CER':>7}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['model']:<8} {r['error']}")
+            continue
+        fmt = lambda value, spec: format(value, spec) if value is not None else "n/a"
+        print(f"{r['model']:<8} {r['load_seconds']:>6.1f}s {fmt(r['rtf'], '>7.3f')} {fmt(r['peak_rss_mb'], '>10.0f')} "
+              f"{fmt(r['wer'], '>7.3f')} {fmt(r['cer'], '>7.3f')}{'  *' if r['pareto'] else ''}")
+    print("* on the speed/accuracy Pareto front (no model is both faster and more accurate)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Whisper models on realtime factor, memory and WER/CER.")
+    parser.add_argument("--models", type=str, nargs="*", default=["small", "medium", "large", "turbo"], help="models to compare")
+    parser.add_argument("--folder", type=str, default=None, help="folder of the reference lyrics (default: the corpus store, or original_lyrics without one)")
+    parser.add_argument("--audio", type=str, default="songs", help="folder of the audio files, named like the references")
+    parser.add_argument("--out", type=str, default=RESULTS_DIR, help="folder for the transcripts and results.json")
+    parser.add_argument("--device", type=str, default="auto", help="cpu, cuda or auto")
+    parser.add_argument("--dtype", type=str, default="auto", help="float32, float16, int8 or auto")
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads")
+    parser.add_argument("--vad", action='store_true', help="use the VAD-gated transcription")
+    parser.add_argument("--limit", type=int, default=None, help="only benchmark the first N songs")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes of the WER scoring")
+    parser.add_argument("--worker", type=str, default=None, help=argparse.SUPPRESS) # internal: benchmark one model
+    parser.add_argument("--songs-file", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("-w","--warnings", action='store_true', help="unsuppress warnings")
+    args = parser.parse_args()
+
+    if not args.warnings:
+        warnings.filterwarnings("ignore")
+    if args.worker:
+        with open(args.songs_file, encoding='utf-8') as f:
+            songs = json.load(f)
+        result = _run_model(args.worker, songs, os.path.join(args.out, "transcripts"), args.device, args.dtype, args.threads, args.vad)
+        with open(os.path.join(args.out, f"{args.worker}.run.json"), 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+    else:
+        print_summary(run_benchmark(args.models, args.folder, args.audio, args.out, args.device, args.dtype,
+                                    args.threads, args.vad, args.limit, args.workers))
@@ -0,0 +1,173 @@
+# indexed store of the reference lyrics corpus: one SQLite file instead of one .txt per song in original_lyrics/
+import argparse
+import os
+import sqlite3
+import threading
+import time
+import normalization
+from normalization import strip_tags
+
+CORPUS_PATH = os.getenv("CORPUS_PATH", "original_lyrics.sqlite")
+LEGACY_FOLDER = "original_lyrics"
+
+def song_key(artist, album):
+    """Key of a song, the same "<artist> - <album>" as its legacy file name."""
+    return f"{artist} - {album}"
+
+def normalize_lyrics(lyrics):
+    # WER's cleaning, done once at ingestion
+    return normalization.normalize(lyrics)
+
+class CorpusStore:
+    def __init__(self, path=CORPUS_PATH, readonly=False):
+        """
+        Args:
+            path (str): SQLite database file.
+            readonly (bool): Open an existing store without writing to it.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        if readonly:
+            self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS songs (
+                key TEXT PRIMARY KEY, artist TEXT, album TEXT, url TEXT, lyrics TEXT, normalized TEXT, updated REAL)""")
+            if self._db.execute("SELECT COUNT(*) FROM songs").fetchone()[0] == 0:
+                self._db.execute(f"PRAGMA user_version = {normalization.VERSION}")
+            self._db.commit()
+        # the normalized column was written by another version of the normalization
+        self.stale = self._db.execute("PRAGMA user_version").fetchone()[0] != normalization.VERSION
+        if self.stale and not readonly:
+            self.renormalize()
+
+    def put_many(self, songs):
+        """
+        Insert or replace songs in one transaction.
+
+        Args:
+            songs (iterable): (artist, album, url, raw lyrics) tuples.
+        Returns:
+            int: Number of songs written.
+        """
+        now = time.time()
+        rows = [(song_key(artist, album), artist, album, url, lyrics, normalize_lyrics(lyrics), now)
+                for artist, album, url, lyrics in songs]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+        return len(rows)
+
+    def renormalize(self, batch_size=512):
+        """Recompute the normalized text of every song with the current normalization."""
+        with self._lock:
+            rows = self._db.execute("SELECT key, lyrics FROM songs").fetchall()
+            for start in range(0, len(rows), batch_size):
+                self._db.executemany("UPDATE songs SET normalized = ? WHERE key = ?",
+                                     [(normalize_lyrics(lyrics), key) for key, lyrics in rows[start:start + batch_size]])
+            self._db.execute(f"PRAGMA user_version = {normalization.VERSION}")
+            self._db.commit()
+        self.stale = False
+        print(f"Renormalized {len(rows)} songs in {self.path}")
+
+    def put(self, artist, album, url, lyrics):
+        self.put_many([(artist, album, url, lyrics)])
+
+    def get(self, key):
+        """The song stored under "<artist> - <album>" as a dict, None when it isn't in the corpus."""
+        with self._lock:
+            cursor = self._db.execute("SELECT key, artist, album, url, lyrics, normalized FROM songs WHERE key = ?", (key,))
+            row = cursor.fetchone()
+        return self._song(row) if row is not None else None
+
+    def songs(self, columns=('key', 'artist', 'album', 'url', 'lyrics', 'normalized')):
+        """Iterate over every song in key order, fetching only the given columns."""
+        query = f"SELECT {', '.join(columns)} FROM songs ORDER BY key"
+        cursor = self._db.cursor()
+        cursor.execute(query)
+        while True:
+            rows = cursor.fetchmany(512)
+            if not rows:
+                return
+            for row in rows:
+                yield dict(zip(columns, row))
+
+    def links(self):
+        """(key, YouTube URL) of every song."""
+        return [(song['key'], song['url']) for song in self.songs(columns=('key', 'url'))]
+
+    def references(self):
+        """Song key -> normalized lyrics, the references of the WER evaluation."""
+        if self.stale: # read-only store normalized by another version
+            return {song['key']: normalize_lyrics(song['lyrics']) for song in self.songs(columns=('key', 'lyrics'))}
+        return {song['key']: song['normalized'] for song in self.songs(columns=('key', 'normalized'))}
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM songs WHERE key = ?", (key,)).fetchone() is not None
+
+    @staticmethod
+    def _song(row):
+        return dict(zip(('key', 'artist', 'album', 'url', 'lyrics', 'normalized'), row))
+
+    def export_folder(self, folder_path=LEGACY_FOLDER):
+        """Write every song as "<key>.txt" (URL, blank line, lyrics without tags), the legacy original_lyrics layout."""
+        os.makedirs(folder_path, exist_ok=True)
+        count = 0
+        for song in self.songs(columns=('key', 'url', 'lyrics')):
+            with open(os.path.join(folder_path, f"{song['key']}.txt"), "w", encoding="utf-8") as f:
+                f.write(song['url'] + "\n\n")
+                f.write(strip_tags(song['lyrics']))
+            count += 1
+        print(f"Exported {count} songs to {folder_path}")
+        return count
+
+    def import_folder(self, folder_path=LEGACY_FOLDER, batch_size=512):
+        """Load a legacy original_lyrics folder into the store."""
+        batch, count = [], 0
+        for fname in sorted(os.listdir(folder_path)):
+            if not fname.endswith('.txt'):
+                continue
+            with open(os.path.join(folder_path, fname), encoding="utf-8") as f:
+                url = f.readline().strip()
+                f.readline() # empty line
+                lyrics = f.read()
+            artist, _, album = fname[:-len('.txt')].partition(' - ')
+            batch.append((artist, album, url, lyrics))
+            if len(batch) >= batch_size:
+                count += self.put_many(batch)
+                batch = []
+        count += self.put_many(batch)
+        print(f"Imported {count} songs from {folder_path}")
+        return count
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the lyrics corpus store.")
+    parser.add_argument("command", choices=["import", "export", "stats"], help="import or export the legacy folder, or count the songs")
+    parser.add_argument("--store", type=str, default=CORPUS_PATH, help="SQLite file of the corpus")
+    parser.add_argument("--folder", type=str, default=LEGACY_FOLDER, help="legacy one-file-per-song folder")
+    args = parser.parse_args()
+
+    with CorpusStore(args.store, readonly=args.command != "import") as store:
+        if args.command == "import":
+            store.import_folder(args.folder)
+        elif args.command == "export":
+            store.export_folder(args.folder)
+        else:
+            print(f"{len(store)} songs in {args.store}")
@@ -0,0 +1,152 @@
+# for decoding a song once and sharing the PCM samples between the whisper and librosa stages
+import glob
+import hashlib
+import os
+import threading
+import numpy as np
+
+WHISPER_SR = 16000 # whisper's expected sample rate
+LIBROSA_SR = 22050 # librosa's default sample rate
+
+# On-disk cache of decoded samples, one .npy per (content hash, sample rate), opened memory-mapped.
+CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+CACHE_BUDGET_MB = float(os.getenv("AUDIO_CACHE_MB", 4096))
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents, used to key cached decodings."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _open_cached(cache_path):
+    # zero-copy, read-only view of the cached samples; touching the file marks it as recently used
+    try:
+        os.utime(cache_path)
+    except PermissionError: # read-only cache
+        pass
+    return np.load(cache_path, mmap_mode='r')
+
+def _store_cached(cache_dir, cache_path, samples):
+    # write to a temporary file first so concurrent workers never see a partial array
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(samples, dtype=np.float32))
+    os.replace(tmp_path, cache_path)
+    evict_cache(cache_dir, keep=cache_path)
+    return _open_cached(cache_path)
+
+def evict_cache(cache_dir=CACHE_DIR, budget_mb=None, keep=None):
+    """Delete the least recently used cached decodings until the cache fits its size budget."""
+    budget = (CACHE_BUDGET_MB if budget_mb is None else budget_mb) * 1024 * 1024
+    entries = []
+    for cache_path in glob.glob(os.path.join(cache_dir, '*.npy')):
+        try:
+            stat = os.stat(cache_path)
+        except FileNotFoundError: # removed by another worker
+            continue
+        entries.append((stat.st_mtime, stat.st_size, cache_path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, cache_path in sorted(entries):
+        if total <= budget:
+            break
+        if cache_path == keep: # the entry that was just written
+            continue
+        try:
+            os.remove(cache_path)
+        except FileNotFoundError: # removed by another worker
+            pass
+        except OSError: # memory-mapped by another worker (Windows refuses to delete it), keep it
+            continue
+        total -= size
+
+class DecodedAudio:
+    def __init__(self, samples, sr, path=None, digest=None, cache_dir=None):
+        """Wrap mono float32 samples at their native sample rate."""
+        self.path = path
+        self.sr = sr
+        self.digest = digest
+        self.cache_dir = cache_dir
+        self._views = {sr: samples}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, cache_dir=CACHE_DIR):
+        """
+        Return the decoded song from the on-disk cache, decoding and caching it on a miss.
+
+        Args:
+            path (str): Path to the audio file.
+            cache_dir (str): Cache folder, None to always decode.
+        Returns:
+            DecodedAudio: Samples backed by memory-mapped cache files.
+        """
+        if cache_dir is None:
+            return cls.from_file(path)
+        digest = file_digest(path)
+        for cache_path in glob.glob(os.path.join(cache_dir, f"{digest}.native.*.npy")):
+            sr = int(cache_path.rsplit('.', 2)[-2])
+            try:
+                return cls(_open_cached(cache_path), sr, path, digest, cache_dir)
+            except (FileNotFoundError, ValueError): # evicted or damaged, decode again
+                break
+        audio = cls.from_file(path)
+        cache_path = os.path.join(cache_dir, f"{digest}.native.{audio.sr}.npy")
+        samples = _store_cached(cache_dir, cache_path, audio.at())
+        return cls(samples, audio.sr, path, digest, cache_dir)
+
+    @classmethod
+    def from_file(cls, path):
+        """Decode an audio file once into mono float32 samples in [-1, 1]."""
+        from pydub import AudioSegment # only needed on a cache miss
+        audio = AudioSegment.from_file(path)
+        samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+        if audio.channels > 1:
+            samples = samples.reshape(-1, audio.channels).mean(axis=1)
+        samples /= float(1 << (8 * audio.sample_width - 1))
+        return cls(samples, audio.frame_rate, path)
+
+    @property
+    def duration(self):
+        """Length of the song in seconds."""
+        return len(self._views[self.sr]) / self.sr
+
+    def at(self, sr=None):
+        """
+        Return the samples resampled to sr, computing each rate only once.
+
+        Args:
+            sr (int): Target sample rate, None for the native rate.
+        Returns:
+            np.ndarray: Mono float32 samples.
+        """
+        if sr is None:
+            sr = self.sr
+        with self._lock:
+            if sr not in self._views:
+                self._views[sr] = self._resample(sr)
+            return self._views[sr]
+
+    def _resample(self, sr):
+        cache_path = None
+        if self.cache_dir is not None and self.digest is not None:
+            cache_path = os.path.join(self.cache_dir, f"{self.digest}.{sr}.npy")
+            try:
+                return _open_cached(cache_path)
+            except (FileNotFoundError, ValueError):
+                pass
+        import librosa
+        samples = librosa.resample(self._views[self.sr], orig_sr=self.sr, target_sr=sr)
+        if cache_path is not None:
+            return _store_cached(self.cache_dir, cache_path, samples)
+        return samples
+
+    def for_whisper(self):
+        """Samples at the 16 kHz rate whisper expects."""
+        return self.at(WHISPER_SR)
+
+    def for_librosa(self):
+        """Samples at librosa's default 22.05 kHz rate."""
+        return self.at(LIBROSA_SR)
@@ -1,9 +1,95 @@
 # for manipulating the all_songs_data.json and assosciated files
 import json
-import re # regular expressions
 import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from corpus_store import CorpusStore, CORPUS_PATH
+from normalization import strip_tags
 
-def save_song_details(json_data):
+def iter_songs(fname, chunk_size=1 << 20):
+    """
+    Yield the songs of a JSON array file one at a time, reading it in chunks instead of loading it whole,
+    so memory stays flat and stopping early skips the rest of the file.
+
+    Args:
+        fname (str): JSON file holding one array of song objects.
+        chunk_size (int): Characters read at a time.
+    """
+    decoder = json.JSONDecoder()
+    with open(fname, encoding="utf-8") as f:
+        buffer, pos, eof = "", 0, False
+        started = False
+        while True:
+            # skip whitespace and the separators between the array's elements
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ',' or (buffer[pos] == '[' and not started)):
+                started = started or buffer[pos] == '['
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            if pos < len(buffer):
+                try:
+                    song, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    song = None # the object continues in the next chunk
+                if song is not None:
+                    yield song
+                    pos = end
+                    continue
+            elif eof:
+                return
+            # drop what was consumed and read on
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+class LyricsWriter:
+    """Buffers the song files to write and writes them in batches, on a thread pool when workers > 0."""
+    def __init__(self, buffer_size=64, workers=0):
+        self.buffer_size = buffer_size
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.max_pending = 2 * workers
+        self._buffer = []
+        self._pending = set()
+        self.written = 0
+
+    @staticmethod
+    def _write_batch(batch):
+        for file_name, content in batch:
+            with open(file_name, "w", encoding="utf-8") as file:
+                file.write(content)
+
+    def add(self, file_name, content):
+        self._buffer.append((file_name, content))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        self.written += len(batch)
+        if self.pool is None:
+            self._write_batch(batch)
+            return
+        # bound the batches in flight so a slow disk can't make the buffered songs pile up in memory
+        while len(self._pending) >= self.max_pending:
+            done, self._pending = wait(self._pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        self._pending.add(self.pool.submit(self._write_batch, batch))
+
+    def close(self):
+        self.flush()
+        if self.pool is not None:
+            for future in self._pending:
+                future.result()
+            self.pool.shutdown()
+
+def song_details(json_data):
+    """(artist, album, YouTube URL, raw lyrics) of a song, or None when it has no lyrics or URL."""
     artist = json_data["Artist"]
     album = json_data["Album"]
     lyrics = json_data["Lyrics"]
@@ -13,8 +99,6 @@ def save_song_details(json_data):
         print("Lyrics not found!")
         return
     
-    normalized_lyrics = re.sub(r"\[.*?\]", "", lyrics).strip() # remove [Verse ...], [Chorus], etc.
-
     # Extract YouTube URL from the Media field
     media_list = json.loads(media.replace("'", '"'))  # Replace single quotes for valid JSON
     youtube_url = next((item["url"] for item in media_list if item["provider"] == "youtube"), None)
@@ -23,26 +107,51 @@ def save_song_details(json_data):
         print("YouTube URL not found!")
         return
 
+    return artist, album, youtube_url, lyrics
+
+def song_file(json_data):
+    """
+    File name and contents (YouTube URL, blank line, lyrics) of a song in the legacy original_lyrics layout,
+    or None when it has no lyrics or URL.
+    """
+    details = song_details(json_data)
+    if details is None:
+        return None
+    artist, album, youtube_url, lyrics = details
+    normalized_lyrics = strip_tags(lyrics) # remove [Verse ...], [Chorus], etc.
+
     # Create the file name
     file_name = f"original_lyrics/{artist} - {album}.txt"
+    return file_name, youtube_url + "\n\n" + normalized_lyrics
 
+def save_song_details(json_data, writer=None):
+    details = song_file(json_data)
+    if details is None:
+        return
+    file_name, content = details
     # Save the URL and lyrics to the file
-    with open(file_name, "w", encoding="utf-8") as file:
-        file.write(youtube_url + "\n\n")
-        file.write(normalized_lyrics)
-
+    if writer is not None:
+        writer.add(file_name, content)
+    else:
+        LyricsWriter._write_batch([details])
     print(f"File saved as: {file_name}")
 
-def save_links(folder_path = 'original_lyrics/'): # go through current files in original_lyrics/ and extract the links to a seprate file
+def save_links(folder_path = None, store_path = CORPUS_PATH): # extract the links of the corpus to a seprate file
     try:
-        # Get a list of all files in the folder
-        files = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
-        links = []
-        for fname in files:
-            file_path = os.path.join(folder_path, fname)
-            with open(file_path) as f:
-                first_line = f.readline().strip()
-                links.append((fname, first_line))
+        if folder_path is None and os.path.isfile(store_path):
+            # one indexed query instead of opening every file
+            with CorpusStore(store_path, readonly=True) as store:
+                links = [(f"{key}.txt", url) for key, url in store.links()]
+        else:
+            folder_path = folder_path or 'original_lyrics/'
+            # Get a list of all files in the folder
+            files = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
+            links = []
+            for fname in files:
+                file_path = os.path.join(folder_path, fname)
+                with open(file_path) as f:
+                    first_line = f.readline().strip()
+                    links.append((fname, first_line))
         with open('links.txt',"w", encoding="utf-8") as f:
             for tup in links:
                 f.write(tup[0] + " " + tup[1] +"\n")
@@ -56,18 +165,32 @@ def save_links(folder_path = 'original_lyrics/'): # go through current files in
         return []
 
 # os.chdir('C:\\Users\\alimo\\Desktop')
-def driver(fname, limit = 20):
-    with open(fname) as f:
-        data = json.load(f)
-        counter = 0
-        for song in data:
-            if counter < limit:
-                save_song_details(song)
-                counter += 1
-            else:
-                break
-        # test = data[6]['Artist']
-        # print(test)
+def driver(fname, limit = 20, workers = 0, store_path = CORPUS_PATH, legacy = False, batch_size = 512):
+    # songs are parsed one at a time and parsing stops after the first `limit` of them;
+    # they go into the corpus store in batches, and into original_lyrics/ too when legacy is set
+    writer = None
+    if legacy:
+        os.makedirs("original_lyrics", exist_ok=True)
+        writer = LyricsWriter(workers=workers)
+    store = CorpusStore(store_path)
+    batch = []
+    try:
+        for song in islice(iter_songs(fname), limit):
+            details = song_details(song)
+            if details is None:
+                continue
+            batch.append(details)
+            if len(batch) >= batch_size:
+                store.put_many(batch)
+                batch = []
+            if writer is not None:
+                save_song_details(song, writer)
+        store.put_many(batch)
+        print(f"{len(store)} songs in {store_path}")
+    finally:
+        store.close()
+        if writer is not None:
+            writer.close()
         
 if __name__=='__main__':
     fname = 'all_songs_data.json'
@@ -1,37 +1,198 @@
-from pydub import AudioSegment
+import threading
 import librosa
-import librosa.display
-import matplotlib.pyplot as plt
 import numpy as np
-import torch
-from torchvision import models, transforms
 from PIL import Image
+from decoded_audio import DecodedAudio, LIBROSA_SR
+
+# torch/torchvision (CNN), soundfile/soxr (streaming) and pydub (WAV export) are imported where they are used,
+# so feature extraction alone doesn't pay for them at startup
+
+N_FFT = 2048
+HOP_LENGTH = 512
+N_MELS = 128
+SET_OF_NOTES = {
+    0: 'C', 1: 'C#', 2: 'D', 3: 'D#', 4: 'E', 5: 'F', 6: 'F#', 7: 'G', 8: 'G#',
+    9: 'A', 10: 'A#', 11: 'B'
+}
+
+# 256-entry RGB lookup table approximating matplotlib's "magma" (librosa's default for dB spectrograms),
+# interpolated between magma(0), magma(0.1), ..., magma(1) so rendering never needs matplotlib.
+# Each control point sits at the table index matplotlib samples it from, int(x * 256) capped at 255.
+_MAGMA_POINTS = np.array([
+    [0,   0.001462, 0.000466, 0.013866],
+    [25,  0.078815, 0.054184, 0.211667],
+    [51,  0.232077, 0.059889, 0.437695],
+    [76,  0.390384, 0.100379, 0.501864],
+    [102, 0.550287, 0.161158, 0.505719],
+    [128, 0.716387, 0.214982, 0.474720],
+    [153, 0.868793, 0.287728, 0.409303],
+    [179, 0.967671, 0.439703, 0.359810],
+    [204, 0.994738, 0.624350, 0.427397],
+    [230, 0.995680, 0.812706, 0.572645],
+    [255, 0.987053, 0.991438, 0.749504],
+])
+MAGMA_LUT = (np.stack([
+    np.interp(np.arange(256), _MAGMA_POINTS[:, 0], _MAGMA_POINTS[:, channel])
+    for channel in (1, 2, 3)
+], axis=1) * 255).round().astype(np.uint8)
+
+# Map a dB spectrogram through the colormap straight into an image (low frequencies at the bottom)
+def render_spectrogram(S_dB, output_image, size=None):
+    lo, hi = float(S_dB.min()), float(S_dB.max())
+    scaled = (S_dB - lo) * (255.0 / max(hi - lo, 1e-10))
+    image = Image.fromarray(MAGMA_LUT[np.flipud(scaled.astype(np.uint8))], mode="RGB")
+    if size is not None:
+        image = image.resize(size)
+    image.save(output_image)
+    print(f"Mel spectrogram saved to {output_image}")
+    return output_image
+
+# Compute one complex STFT of the song and derive every spectral feature from it.
+# tuning is the chroma tuning (a number, or one per stacked song); when it is None with n_frames given,
+# it is estimated per stacked song on its first n_frames frames so padding and the other songs don't shift it
+def compute_spectra(y, sr, n_fft=N_FFT, hop_length=HOP_LENGTH, n_mels=N_MELS, tuning=None, n_frames=None):
+    magnitude = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length))
+    power = magnitude ** 2
+    mel = librosa.feature.melspectrogram(S=power, sr=sr, n_mels=n_mels)
+
+    spectra = {'magnitude': magnitude, 'mel': mel}
+    # onset strength works on log-power mel; no top_db clipping so the value of a frame only depends on its neighbours
+    spectra['onset_env'] = librosa.onset.onset_strength(S=librosa.power_to_db(mel, top_db=None), sr=sr, hop_length=hop_length)
+    if tuning is None and n_frames is not None:
+        tuning = [librosa.estimate_tuning(S=power[row, :, :frames], sr=sr, bins_per_octave=12) for row, frames in enumerate(n_frames)]
+    if np.ndim(tuning) == 0:
+        spectra['chroma'] = librosa.feature.chroma_stft(S=power, sr=sr, hop_length=hop_length, tuning=tuning)
+    else:
+        spectra['chroma'] = np.stack([librosa.feature.chroma_stft(S=power[row], sr=sr, hop_length=hop_length, tuning=row_tuning)
+                                      for row, row_tuning in enumerate(tuning)])
+    spectra['contrast'] = librosa.feature.spectral_contrast(S=magnitude, sr=sr, hop_length=hop_length)
+    spectra['bandwidth'] = librosa.feature.spectral_bandwidth(S=magnitude, sr=sr, hop_length=hop_length)
+    return spectra
+
+class SpectrogramClassifier:
+    """CNN sentiment classifier over Mel spectrograms, loaded once per process and run in batches."""
+    sentiment_classes = ["Happy", "Sad", "Neutral"]
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, model_name="resnet18", num_threads=None):
+        import torch
+        from torchvision import models
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        model = models.__dict__[model_name](pretrained=True)
+        model.fc = torch.nn.Linear(model.fc.in_features, len(self.sentiment_classes))  # Assuming 3 sentiment classes
+        model.eval()
+        self.model = model
+        self.mean = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1)
+        self.std = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1)
+
+    @classmethod
+    def get(cls, model_name="resnet18", num_threads=None):
+        """Return the process-wide classifier for model_name, building it on first use."""
+        with cls._instances_lock:
+            if model_name not in cls._instances:
+                cls._instances[model_name] = cls(model_name, num_threads)
+            elif num_threads:
+                import torch
+                torch.set_num_threads(num_threads)
+            return cls._instances[model_name]
+
+    def preprocess(self, mel):
+        """Colormap a power Mel spectrogram like the rendered image and normalize it to a 3x224x224 tensor."""
+        import torch
+        S_dB = librosa.power_to_db(mel, ref=np.max)
+        lo, hi = float(S_dB.min()), float(S_dB.max())
+        scaled = (S_dB - lo) * (255.0 / max(hi - lo, 1e-10))
+        rgb = torch.from_numpy(MAGMA_LUT[np.flipud(scaled.astype(np.uint8))]).permute(2, 0, 1).float() / 255
+        rgb = torch.nn.functional.interpolate(rgb.unsqueeze(0), size=(224, 224), mode="bilinear",
+                                              align_corners=False, antialias=True)[0]
+        return (rgb - self.mean) / self.std
+
+    def _classify(self, batch):
+        import torch
+        probabilities = torch.nn.functional.softmax(self.model(batch), dim=1)
+        confidences, predicted = probabilities.max(dim=1)
+        return [(self.sentiment_classes[idx], conf) for idx, conf in zip(predicted.tolist(), confidences.tolist())]
+
+    def predict(self, mels, batch_size=32):
+        """
+        Predict the sentiment of many songs, batch_size spectrograms per forward pass.
+
+        Args:
+            mels (list): Power Mel spectrograms (n_mels x frames), e.g. AudioAnalysis.spectra()['mel'].
+            batch_size (int): Spectrograms per forward pass.
+        Returns:
+            list: (sentiment, confidence) per spectrogram.
+        """
+        import torch
+        results = []
+        with torch.inference_mode():
+            for start in range(0, len(mels), batch_size):
+                batch = torch.stack([self.preprocess(mel) for mel in mels[start:start + batch_size]])
+                results.extend(self._classify(batch))
+        return results
+
+    def predict_image(self, image_path):
+        """Predict the sentiment of a spectrogram saved as an image."""
+        import torch
+        from torchvision import transforms
+        preprocess = transforms.Compose([
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ])
+        image = Image.open(image_path).convert("RGB")
+        with torch.inference_mode():
+            return self._classify(preprocess(image).unsqueeze(0))[0]
 
 class AudioAnalysis:
-    def __init__(self, mp3_path):
+    def __init__(self, mp3_path, audio=None):
         self.mp3_path = mp3_path
         self.wav_path = mp3_path.replace('.mp3', '.wav')
+        self.audio = audio # shared DecodedAudio, decoded on first use when not given
+        self.sr = LIBROSA_SR
+        self._spectra = None
+        self._spectra_lock = threading.Lock()
+
+    # Decode the song once (or map it from the decoded-audio cache), every stage reads its samples from memory
+    def decoded(self):
+        if self.audio is None:
+            self.audio = DecodedAudio.load(self.mp3_path)
+        return self.audio
+
+    # Single STFT pass shared by the spectrogram image and the feature extraction
+    def spectra(self):
+        with self._spectra_lock: # the spectrogram and feature stages may ask for it at the same time
+            if self._spectra is None:
+                self._spectra = compute_spectra(self.decoded().at(self.sr), self.sr)
+            return self._spectra
 
     # Convert MP3 to WAV
     def convert_mp3_to_wav(self):
+        from pydub import AudioSegment
         audio = AudioSegment.from_mp3(self.mp3_path)
         audio.export(self.wav_path, format="wav")
 
     # Generate Mel Spectrogram to analyze it and further extract more information
-    def create_mel_spectrogram(self, output_image="mel_spectrogram.png"):
+    # annotated=True plots axes and a colorbar through matplotlib; otherwise the dB array is colormapped directly
+    def create_mel_spectrogram(self, output_image="mel_spectrogram.png", annotated=False, size=None):
         try:
-            # Load the audio file
-            y, sr = librosa.load(self.wav_path, sr=None)
-
-            # Create a Mel spectrogram
-            S = librosa.feature.melspectrogram(y=y, sr=sr, n_fft=2048, hop_length=512, n_mels=128)
+            # Reuse the shared Mel spectrogram
+            S = self.spectra()['mel']
 
             # Convert to decibels
             S_dB = librosa.power_to_db(S, ref=np.max)
 
+            if not annotated:
+                return render_spectrogram(S_dB, output_image, size)
+
+            import librosa.display
+            import matplotlib.pyplot as plt
+
             # Plot and save the spectrogram
             plt.figure(figsize=(10, 4))
-            librosa.display.specshow(S_dB, sr=sr, hop_length=512, x_axis="time", y_axis="mel")
+            librosa.display.specshow(S_dB, sr=self.sr, hop_length=HOP_LENGTH, x_axis="time", y_axis="mel")
             plt.colorbar(format="%+2.0f dB")
             plt.title("Mel Spectrogram")
             plt.tight_layout()
@@ -39,63 +200,36 @@ class AudioAnalysis:
             plt.close()
 
             print(f"Mel spectrogram saved to {output_image}")
+            return output_image
 
         except Exception as e:
             print(f"Error generating spectrogram: {e}")
 
 
-    # Apply a sentiment analysis to the generated spectrogram using Resnet18 CNN model
-    def predict_sentiment_from_spectrogram(self, image_path, model_name="resnet18"):
+    # Apply a sentiment analysis to the spectrogram using Resnet18 CNN model
+    # (the in-memory Mel spectrogram is used unless a saved image is given)
+    def predict_sentiment_from_spectrogram(self, image_path=None, model_name="resnet18"):
         try:
-            model = models.__dict__[model_name](pretrained=True)
-            model.fc = torch.nn.Linear(model.fc.in_features, 3)  # Assuming 3 sentiment classes
-            model.eval()
-
-            # Define image transformations
-            preprocess = transforms.Compose([
-                transforms.Resize((224, 224)),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-            ])
-
-            # Load and preprocess the image
-            image = Image.open(image_path).convert("RGB")
-            input_tensor = preprocess(image).unsqueeze(0)
-
-            # Run the model
-            with torch.no_grad():
-                outputs = model(input_tensor)
-                probabilities = torch.nn.functional.softmax(outputs[0], dim=0)
-                predicted_class = torch.argmax(probabilities).item()
-
-            # Map class indices to sentiments
-            sentiment_classes = ["Happy", "Sad", "Neutral"]
-            sentiment = sentiment_classes[predicted_class]
-            confidence = probabilities[predicted_class].item()
-
-            return sentiment, confidence
+            classifier = SpectrogramClassifier.get(model_name)
+            if image_path is not None:
+                return classifier.predict_image(image_path)
+            return classifier.predict([self.spectra()['mel']])[0]
 
         except Exception as e:
             print(f"Error during sentiment prediction: {e}")
             return None, None
 
-    # This function extracts as many features as we can from the spectrogram
-    def extract_audio_features(self, mel_spectrogram, sr):
+    # This function extracts as many features as we can from the shared spectra
+    def extract_audio_features(self, spectra, sr):
         features = {}
-        set_of_notes = {
-            0: 'C', 1: 'C#', 2: 'D', 3: 'D#', 4: 'E', 5: 'F', 6: 'F#', 7: 'G', 8: 'G#',
-            9: 'A', 10: 'A#', 11: 'B'
-        }
 
         # Rhythm
-        onset_env = librosa.onset.onset_strength(S=mel_spectrogram, sr=sr)
-        tempo, beats = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
+        tempo, beats = librosa.beat.beat_track(onset_envelope=spectra['onset_env'], sr=sr, hop_length=HOP_LENGTH)
         features['tempo'] = tempo
         features['beats'] = beats
 
         # Texture
-        spectral_contrast = librosa.feature.spectral_contrast(S=mel_spectrogram, sr=sr)
-        average_spectral_contrast = spectral_contrast.mean(axis=1)
+        average_spectral_contrast = spectra['contrast'].mean(axis=1)
         avg_contrast = np.mean(average_spectral_contrast) / 100
         print("\n\navg contrast:",avg_contrast)
         features['average_spectral_contrast'] = avg_contrast
@@ -110,30 +244,165 @@ class AudioAnalysis:
         #     features['type'] = "Heavy Metal / Noisy / Percussive"
 
         # Noise and Percussion
-        spectral_bandwidth = np.average(librosa.feature.spectral_bandwidth(S=mel_spectrogram, sr=sr))
+        spectral_bandwidth = np.average(spectra['bandwidth'])
         features['spectral_bandwidth'] = spectral_bandwidth
 
         # Extract the dominant note
-        stft = librosa.stft(mel_spectrogram)  # Compute STFT
-        chroma = librosa.feature.chroma_stft(S=np.abs(stft), sr=sr)
-        chroma_mean = np.mean(chroma, axis=1)
-        Dominant_note_idx = np.argmax(chroma_mean) % 12  # Ensure valid note index
-        Dominant_note = set_of_notes[Dominant_note_idx]
+        chroma_mean = np.mean(spectra['chroma'], axis=1)
+        Dominant_note_idx = np.argmax(chroma_mean)
+        Dominant_note = SET_OF_NOTES[Dominant_note_idx]
         features['Dominant_Note'] = Dominant_note
 
         return features
 
     def analyze(self):
-        # Load the audio file
-        y, sr = librosa.load(self.wav_path)
+        # Extract audio features from the single STFT of the song
+        features = self.extract_audio_features(self.spectra(), self.sr)
 
-        # Create Mel spectrogram
-        mel_spectrogram = librosa.feature.melspectrogram(y=y, sr=sr)
+        return features
 
-        # Extract audio features
-        features = self.extract_audio_features(mel_spectrogram, sr)
+    # Same features as analyze(), computed block by block so memory stays bounded on hour-long recordings
+    def analyze_streaming(self, block_seconds=30.0):
+        sr = self.sr
+        buffer = np.zeros(N_FFT // 2, dtype=np.float32) # match the zero padding of librosa.stft(center=True)
+        totals = {'chroma': np.zeros(12), 'contrast': np.zeros(7), 'bandwidth': 0.0}
+        n_frames = 0
+        # onset strength of a frame depends on the previous one; start with the padding librosa puts in front
+        onset_blocks = [np.zeros(1 + N_FFT // (2 * HOP_LENGTH))]
+        prev_db = None
+        tuning = None
 
-        return features
+        for y in _stream_samples(self.mp3_path, sr, block_seconds, self.audio):
+            buffer = np.concatenate([buffer, y])
+            n = (len(buffer) - N_FFT) // HOP_LENGTH + 1 if len(buffer) >= N_FFT else 0
+            if n <= 0:
+                continue
+            magnitude = np.abs(librosa.stft(buffer[:(n - 1) * HOP_LENGTH + N_FFT], n_fft=N_FFT, hop_length=HOP_LENGTH, center=False))
+            buffer = buffer[n * HOP_LENGTH:]
+
+            power = magnitude ** 2
+            db = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sr, n_mels=N_MELS), top_db=None)
+            if prev_db is not None:
+                db_with_prev = np.concatenate([prev_db, db], axis=1)
+            else:
+                db_with_prev = db
+            onset_blocks.append(np.maximum(0.0, np.diff(db_with_prev, axis=1)).mean(axis=0))
+            prev_db = db[:, -1:]
+
+            # tuning is estimated once, from the first block, instead of over the whole song
+            if tuning is None:
+                tuning = librosa.estimate_tuning(S=power, sr=sr, bins_per_octave=12)
+            totals['chroma'] += librosa.feature.chroma_stft(S=power, sr=sr, tuning=tuning).sum(axis=1)
+            totals['contrast'] += librosa.feature.spectral_contrast(S=magnitude, sr=sr).sum(axis=1)
+            totals['bandwidth'] += librosa.feature.spectral_bandwidth(S=magnitude, sr=sr).sum()
+            n_frames += magnitude.shape[1]
+
+        if n_frames == 0:
+            raise ValueError(f"No audio could be read from {self.mp3_path}")
+
+        # single-column "spectra" holding the per-frame means, so the features are summarized like analyze()
+        summary = {
+            'onset_env': np.concatenate(onset_blocks)[:n_frames],
+            'chroma': (totals['chroma'] / n_frames)[:, None],
+            'contrast': (totals['contrast'] / n_frames)[:, None],
+            'bandwidth': np.array([[totals['bandwidth'] / n_frames]]),
+        }
+        return self.extract_audio_features(summary, sr)
+
+
+# Yield mono blocks of the song resampled to sr, followed by the zero padding librosa.stft(center=True) adds at the end
+def _stream_samples(path, sr, block_seconds, audio=None):
+    import soundfile as sf
+    import soxr
+    pad = np.zeros(N_FFT // 2, dtype=np.float32)
+    try:
+        f = sf.SoundFile(path)
+    except RuntimeError: # format libsndfile can't read, fall back to the memory-mapped decoded-audio cache
+        if audio is None:
+            audio = DecodedAudio.load(path)
+        samples = audio.at(sr)
+        blocksize = int(block_seconds * sr)
+        for start in range(0, len(samples), blocksize):
+            yield np.asarray(samples[start:start + blocksize], dtype=np.float32)
+        yield pad
+        return
+
+    with f:
+        resampler = soxr.ResampleStream(f.samplerate, sr, 1, dtype='float32') if f.samplerate != sr else None
+        blocksize = int(block_seconds * f.samplerate)
+        while True:
+            block = f.read(blocksize, dtype='float32', always_2d=True)
+            last = len(block) < blocksize
+            y = block.mean(axis=1)
+            if resampler is not None:
+                y = resampler.resample_chunk(y, last=last)
+            if len(y):
+                yield y
+            if last:
+                break
+    yield pad
+
+# Group songs of similar length so padding each group to its longest song wastes little work
+def _length_buckets(lengths, bucket_ratio, max_batch):
+    order = np.argsort(lengths, kind='stable')
+    buckets, current = [], []
+    for idx in order:
+        if current and (len(current) == max_batch or lengths[idx] > lengths[current[0]] * bucket_ratio):
+            buckets.append(current)
+            current = []
+        current.append(idx)
+    if current:
+        buckets.append(current)
+    return buckets
+
+def extract_features_batch(songs, sr=LIBROSA_SR, bucket_ratio=1.25, max_batch=8):
+    """
+    Extract the instrumental features of many songs with stacked STFT/feature calls.
+
+    Args:
+        songs (list): Paths of the songs or DecodedAudio objects.
+        sr (int): Sample rate to analyze at.
+        bucket_ratio (float): Longest/shortest length ratio allowed inside one padded batch.
+        max_batch (int): Maximum number of songs stacked into one batch.
+    Returns:
+        dict: Columnar feature table; every column is ordered like songs.
+    """
+    audios = [song if isinstance(song, DecodedAudio) else DecodedAudio.load(song) for song in songs]
+    signals = [audio.at(sr) for audio in audios]
+    lengths = np.array([len(y) for y in signals])
+
+    n = len(signals)
+    table = {
+        'song': [audio.path for audio in audios],
+        'duration': lengths / sr,
+        'tempo': np.zeros(n),
+        'average_spectral_contrast': np.zeros(n),
+        'spectral_bandwidth': np.zeros(n),
+        'chroma_mean': np.zeros((n, 12)),
+    }
+
+    for bucket in _length_buckets(lengths, bucket_ratio, max_batch):
+        # zero-pad the bucket to its longest song and run every transform once on the stacked array
+        batch = np.zeros((len(bucket), lengths[bucket].max()), dtype=np.float32)
+        for row, idx in enumerate(bucket):
+            batch[row, :lengths[idx]] = signals[idx]
+        # frames past the end of a song are padding and must not count towards its averages or its tuning
+        n_frames = 1 + lengths[bucket] // HOP_LENGTH
+        spectra = compute_spectra(batch, sr, n_frames=n_frames)
+
+        mask = np.arange(spectra['chroma'].shape[-1]) < n_frames[:, None]
+        def masked_mean(values):
+            return (values * mask[:, None, :]).sum(axis=-1) / n_frames[:, None]
+
+        table['chroma_mean'][bucket] = masked_mean(spectra['chroma'])
+        table['average_spectral_contrast'][bucket] = masked_mean(spectra['contrast']).mean(axis=1) / 100
+        table['spectral_bandwidth'][bucket] = masked_mean(spectra['bandwidth'])[:, 0]
+        for row, idx in enumerate(bucket):
+            tempo, _ = librosa.beat.beat_track(onset_envelope=spectra['onset_env'][row, :n_frames[row]], sr=sr, hop_length=HOP_LENGTH)
+            table['tempo'][idx] = np.atleast_1d(tempo)[0]
+
+    table['Dominant_Note'] = np.array([SET_OF_NOTES[idx] for idx in np.argmax(table['chroma_mean'], axis=1)])
+    return table
 
 
 if __name__ == "__main__":
@@ -141,10 +410,6 @@ if __name__ == "__main__":
     song_path = "songs/Psychostick - I Can Only Count to FOUR.mp3"
     audio_analysis = AudioAnalysis(song_path)
 
-    # Convert MP3 to WAV
-    audio_analysis.convert_mp3_to_wav()
-    print("Conversion from mp3 to wav complete")
-
     # Create and save Mel Spectrogram
     audio_analysis.create_mel_spectrogram()
 
@@ -0,0 +1,173 @@
+# asyncio request layer shared by the GPT analysis, prompt generation and DALL-E stages
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+import numpy as np
+import openai
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+import response_cache
+
+# (requests per minute, tokens per minute) per model; None means unlimited
+DEFAULT_LIMITS = {
+    'gpt-4o': (500, 30000),
+    'gpt-3.5-turbo': (500, 200000),
+    'dall-e-3': (7, None),
+}
+FALLBACK_LIMITS = (60, None)
+
+# errors worth retrying: 429s, 5xx responses, timeouts and dropped connections
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+class RateBudget:
+    """Sliding one-minute window of the requests and tokens spent against one model's budget."""
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.events = deque() # (timestamp, tokens)
+
+    async def acquire(self, tokens):
+        """Wait until one more request of the given token cost fits in the window, then record it."""
+        while True:
+            now = time.monotonic()
+            while self.events and now - self.events[0][0] >= 60:
+                self.events.popleft()
+            used = sum(spent for _, spent in self.events)
+            fits_requests = self.rpm is None or len(self.events) < self.rpm
+            # a request larger than the whole budget is let through alone rather than blocking forever
+            fits_tokens = self.tpm is None or used + tokens <= self.tpm or not self.events
+            if fits_requests and fits_tokens:
+                self.events.append((now, tokens))
+                return
+            await asyncio.sleep(max(60 - (now - self.events[0][0]), 0.01))
+
+class RequestLayer:
+    def __init__(self, api_key=None, base_url=None, max_in_flight=8, limits=None, budget_share=1.0,
+                 max_retries=5, base_delay=1.0, max_delay=60.0, timeout=120.0, cache=None):
+        """
+        Args:
+            api_key (str): OpenAI API key.
+            base_url (str): API endpoint, e.g. a local stub server (defaults to OPENAI_BASE_URL or api.openai.com).
+            max_in_flight (int): Maximum number of requests awaiting a response at once.
+            limits (dict): Model -> (requests per minute, tokens per minute), overriding DEFAULT_LIMITS.
+            budget_share (float): Fraction of each budget this process may use (1 / number of batch workers).
+            max_retries (int): Retries of a rate-limited or failed request before giving up.
+            base_delay (float): First backoff delay in seconds, doubled on every retry.
+            max_delay (float): Cap of the backoff delay in seconds.
+            timeout (float): Per-request timeout in seconds.
+            cache (response_cache.ResponseCache): Cache of chat responses, None to always call the API.
+        """
+        self.max_in_flight = max_in_flight
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.budget_share = budget_share
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cache = cache
+        # the SDK's own retries are disabled so every retry goes through the budgets and backoff below
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=timeout)
+        self.latencies = {}
+        self.retries = {}
+        self._budgets = {}
+        self._semaphore = None
+
+        # the event loop runs on its own thread so the synchronous stages (and several threads at once) can share it
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True)
+        self._thread.start()
+
+    def _budget(self, model):
+        if model not in self._budgets:
+            rpm, tpm = self.limits.get(model, FALLBACK_LIMITS)
+            scale = lambda limit: None if limit is None else max(1, int(limit * self.budget_share))
+            self._budgets[model] = RateBudget(scale(rpm), scale(tpm))
+        return self._budgets[model]
+
+    def _backoff(self, attempt, error):
+        # exponential backoff with full jitter, never shorter than the server's Retry-After
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        response = getattr(error, 'response', None)
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get('retry-after', 0)))
+            except ValueError:
+                pass
+        return delay
+
+    async def _request(self, model, tokens, call):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        budget = self._budget(model)
+        for attempt in range(self.max_retries + 1):
+            await budget.acquire(tokens)
+            async with self._semaphore:
+                start = time.monotonic()
+                try:
+                    response = await call()
+                except RETRYABLE_ERRORS as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = self._backoff(attempt, e)
+                else:
+                    self.latencies.setdefault(model, []).append(time.monotonic() - start)
+                    return response
+            self.retries[model] = self.retries.get(model, 0) + 1
+            await asyncio.sleep(delay)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def achat(self, model, messages, **kwargs):
+        """Chat completion request, answered from the response cache or queued behind the concurrency limit and the model's budget."""
+        key = None
+        if self.cache is not None:
+            key = response_cache.request_key(model, messages, **kwargs)
+            payload = self.cache.get(key)
+            if payload is not None:
+                return ChatCompletion.model_validate_json(payload)
+
+        # rough token cost: ~4 characters per token for the prompt plus the completion allowance
+        tokens = len(json.dumps(messages)) // 4 + kwargs.get('max_tokens', 1024)
+        response = await self._request(model, tokens, lambda: self.client.chat.completions.create(model=model, messages=messages, **kwargs))
+        if key is not None:
+            self.cache.put(key, model, response.model_dump_json())
+        return response
+
+    async def agenerate_image(self, model, prompt, **kwargs):
+        """Image generation request, queued behind the concurrency limit and the model's budget."""
+        return await self._request(model, 0, lambda: self.client.images.generate(model=model, prompt=prompt, **kwargs))
+
+    def chat(self, model, messages, **kwargs):
+        """Blocking form of achat for the synchronous pipeline stages."""
+        return self._run(self.achat(model, messages, **kwargs))
+
+    def generate_image(self, model, prompt, **kwargs):
+        """Blocking form of agenerate_image for the synchronous pipeline stages."""
+        return self._run(self.agenerate_image(model, prompt, **kwargs))
+
+    def metrics(self):
+        """Per-model call count, retries and latency percentiles in seconds."""
+        summary = {}
+        for model, values in self.latencies.items():
+            p50, p95 = np.percentile(values, [50, 95])
+            summary[model] = {'calls': len(values), 'retries': self.retries.get(model, 0),
+                              'mean': float(np.mean(values)), 'p50': float(p50), 'p95': float(p95)}
+        return summary
+
+    def print_metrics(self):
+        for model, stats in self.metrics().items():
+            print(f"{model:<14} calls: {stats['calls']:<4} retries: {stats['retries']:<3} "
+                  f"p50: {stats['p50']:.2f}s  p95: {stats['p95']:.2f}s")
+        if self.cache is not None:
+            print(f"response cache ({self.cache.mode}): {self.cache.hits} hits, {self.cache.misses} misses")
+
+    def close(self):
+        """Close the HTTP client and stop the event loop."""
+        self._run(self.client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        if self.cache is not None:
+            self.cache.close()
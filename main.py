@@ -1,201 +1,453 @@
 import argparse
 import os
+import re
+import subprocess
+import sys
 import time
-import numpy as np
+import threading
 import warnings
-from openai import OpenAI
-import whisper_script
-import sentiments_script
-import prompt_script
-import art_script
-import instrumentals_script
+import batch_script
+import server_script
+import response_cache
+import transcripts
+from stage_graph import Stage, StageGraph
 
-def main():
+# the stage modules pull in whisper, transformers, torch, librosa and openai; they are imported inside
+# the stages that use them so e.g. --depth 1 --mode lyrical never loads the instrumental or LLM stack
 
+# LyricAnalyzer instances (and their HuggingFace pipelines) kept warm per detected language
+_ANALYZERS = {}
+_ANALYZERS_LOCK = threading.Lock()
 
+def build_parser():
     # argument handling
     parser = argparse.ArgumentParser(description="Transcribe audio files using OpenAI's Whisper model.")
-    parser.add_argument("file", type=str, help="Path to the audio file.")
+    parser.add_argument("file", type=str, nargs='?', help="Path to the audio file, or a directory, glob or manifest file for batch mode.")
     parser.add_argument("--model", type=str, default="turbo", help="Whisper model to use (small, medium, large, turbo).")
     # parser.add_argument("--output", type=str, help="Path to save the transcription.")
     parser.add_argument("--depth", type=int, default=4, help="Layers to stop at (1: whisper, 2: semantics, 3: prompt, 4: image)")
     parser.add_argument("-v","--verbose", action='store_true', help="print the transcribed lyrics")
     parser.add_argument("-w","--warnings", action='store_true', help="unsuppress warnings")
     parser.add_argument("--mode", type=str, default="lyrical", help="lyrical, instrumental, or hybrid")
-    args = parser.parse_args()
+    parser.add_argument("--annotate", action='store_true', help="draw the spectrogram with axes and a colorbar (uses matplotlib)")
+    parser.add_argument("--word-timestamps", action='store_true', help="store per-word timings and probabilities in the transcript")
+    parser.add_argument("--no-text-view", action='store_true', help="only write the JSONL transcript, not the [start --> end] text view")
+    parser.add_argument("--device", type=str, default="auto", help="whisper device: cuda, cpu or auto (GPU when available)")
+    parser.add_argument("--dtype", type=str, default="auto", help="whisper precision: float32, float16 (GPU decoding), int8 (CPU weights) or auto")
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads (batch mode splits the cores between workers)")
+    parser.add_argument("--vad", action='store_true', help="transcribe only the voiced parts, decoding them in batches (for instrumental-heavy tracks)")
+    parser.add_argument("--stream", action='store_true', help="analyze the instrumentals block by block (for long recordings)")
+    parser.add_argument("--llm-cache", type=str, default="readwrite", choices=response_cache.MODES,
+                        help="GPT response cache: readwrite, readonly, replay (offline, fail on miss) or off")
+    parser.add_argument("--force", action='store_true', help="recompute every stage instead of reusing stored artifacts")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes to use in batch mode")
+    parser.add_argument("--local", action='store_true', help="run in this process even if the inference server is running")
+    parser.add_argument("--port", type=int, default=server_script.DEFAULT_PORT, help="port of the local inference server")
+    parser.add_argument("--import-report", action='store_true', help="report the import time of the modules the selected mode and depth load, then exit")
+    parser.add_argument("--import-budget", type=float, default=None, help="with --import-report, fail if the imports take longer than this many ms")
+    return parser
+
+def main():
+    argv = sys.argv[1:]
+    parser = build_parser()
+    args = parser.parse_args(argv)
 
     if not args.warnings:
         print("\n\nNote: Certain warnings are suppressed!")
         warnings.filterwarnings("ignore")
 
-    print(f"\n\nfile: {args.file}")
+    if (not (args.mode == 'lyrical' or args.mode == 'instrumental' or args.mode == 'hybrid')):
+        print(f"\"{args.mode}\" is not a valid mode")
+        return
 
-    # Check if the file exists
-    if not os.path.isfile(args.file):
-        print(f"Error: File not found: {args.file}")
+    if args.import_report:
+        if not import_report(args):
+            sys.exit(1)
         return
-    song_name = (args.file).split('.mp3', 1)[0].split('/')[-1]
+    # only the import report runs without a song
+    if args.file is None:
+        parser.error("the following arguments are required: file")
 
+    if batch_script.is_batch_target(args.file):
+        songs = batch_script.collect_songs(args.file)
+        if not songs:
+            print(f"Error: No songs found for: {args.file}")
+            return
+    else:
+        # Check if the file exists
+        if not os.path.isfile(args.file):
+            print(f"Error: File not found: {args.file}")
+            return
+        songs = [args.file]
 
-    ###################################
-    #          Transcription          #
-    ###################################
-    
-    # lyrics
-    if (args.mode == 'lyrical' or args.mode == 'hybrid'):
-        start = time.time()
-        print(f"Loading model: {args.model}")
-        transcription_results = whisper_script.transcribe_audio(args.file, model_name=args.model)
-        end = time.time()
-        detected_language = transcription_results.get('language')
-
-        # Print and save the transcription
-        if "segments" in transcription_results:
-            output_transcription = f'lyric_results/{song_name}_({args.model}).txt'
-            whisper_script.save_segments_to_file(transcription_results["segments"], output_transcription)
-            print("\n=== Transcription Complete ===")
-            print(f'\ntime taken: {end-start}\n')
-            print(f"Transcription saved to: {'lyric_results/'+output_transcription}")
-            if args.verbose:
-                print(f'Detected language: {detected_language}')
-                for segment in transcription_results["segments"]:
-                    start = segment['start']
-                    end = segment['end']
-                    text = segment['text']
-                    print(f"[{start:.2f} --> {end:.2f}] {text}")
-        else:
-            print("No transcription segments found.")
-
-    # background music
-    if (args.mode == 'instrumental' or args.mode == 'hybrid'):
-        audio_analyzer = instrumentals_script.AudioAnalysis(args.file)
+    # hand the songs to the warm inference server when one is running
+    if not args.local and server_script.server_running(args.port):
+        print(f"Submitting {len(songs)} song(s) to the inference server on port {args.port}")
+        server_script.submit_and_wait(songs, argv, args.file, args.port)
+        return
 
-        start = time.time()
-        audio_analyzer.convert_mp3_to_wav()
-        end = time.time()
-        print(f"Conversion from mp3 to wav completed in {end - start} seconds.")
+    if batch_script.is_batch_target(args.file):
+        batch_script.run_batch(songs, args)
+        return
+    client = make_client(cache_mode=args.llm_cache) if args.depth > 1 else None
+    run_song(args.file, args, client)
+    if client is not None:
+        if args.verbose:
+            print("\n=== API Latency ===")
+            client.print_metrics()
+        client.close()
 
-        start = time.time()
-        audio_analyzer.create_mel_spectrogram(f'spectograms/{song_name}.png')
-        end = time.time()
-        print(f"mel spectogram created in {end - start} seconds")
+def make_client(budget_share=1.0, cache_mode="readwrite"):
+    """Build the request layer used by every OpenAI stage (OPENAI_BASE_URL points it at a stub server)."""
+    if cache_mode == "replay" and not os.path.isfile("api_key.txt"):
+        api_key = "replay" # offline replay never needs a real key for cached requests
+    else:
+        api_key = get_api_key()
+    import llm_client
+    cache = None if cache_mode == "off" else response_cache.ResponseCache(mode=cache_mode)
+    return llm_client.RequestLayer(api_key=api_key, budget_share=budget_share, cache=cache)
+
+def get_analyzer(client, language):
+    """Return a warm LyricAnalyzer for the detected language."""
+    import sentiments_script
+    with _ANALYZERS_LOCK:
+        if language not in _ANALYZERS:
+            _ANALYZERS[language] = sentiments_script.LyricAnalyzer(client, language)
+        analyzer = _ANALYZERS[language]
+        analyzer.client = client
+        return analyzer
+
+class SongContext:
+    """Per-song state shared by the stages; the song is only decoded once a stage actually needs its samples."""
+    def __init__(self, file, args, client, report):
+        self.file = file
+        self.args = args
+        self.client = client
+        self.report = report
+        self.song_name = (file).split('.mp3', 1)[0].split('/')[-1]
+        self._decoded = None
+        self._audio_analyzer = None
+        self._lock = threading.RLock()
+
+    def decoded(self):
+        # decode the song once (or map it from the cache), both branches share the samples
+        with self._lock:
+            if self._decoded is None:
+                from decoded_audio import DecodedAudio
+                start = time.time()
+                self._decoded = DecodedAudio.load(self.file)
+                end = time.time()
+                self.report['timings']['decode'] = end - start
+                print(f"Decoded audio in {end - start} seconds.")
+            return self._decoded
+
+    def audio_analyzer(self):
+        # one AudioAnalysis per song so the spectrogram and feature stages share a single STFT;
+        # streaming analysis reads the file block by block instead of holding the whole song
+        with self._lock:
+            if self._audio_analyzer is None:
+                import instrumentals_script
+                audio = None if self.args.stream else self.decoded()
+                self._audio_analyzer = instrumentals_script.AudioAnalysis(self.file, audio=audio)
+            return self._audio_analyzer
+
+    def transcript_path(self):
+        return f'lyric_results/{self.song_name}_({self.args.model}).txt'
+
+    def segments_path(self):
+        return transcripts.jsonl_path(self.transcript_path())
 
+def _file_exists(path):
+    return path is not None and os.path.isfile(path)
+
+def _transcript_exists(transcription):
+    # the JSONL transcript and, when one was written, its text view
+    return _file_exists(transcription.get('path')) and (transcription.get('text_path') is None or _file_exists(transcription['text_path']))
+
+###################################
+#          Transcription          #
+###################################
+
+def transcribe_stage(inputs, ctx):
+    import whisper_script
+    args = ctx.args
+    start = time.time()
+    print(f"Loading model: {args.model}")
+    # segments are appended to the JSONL transcript (and its text view) as they are decoded
+    text_view = None if args.no_text_view else ctx.transcript_path()
+    with transcripts.SegmentWriter(ctx.segments_path(), text_path=text_view) as writer:
+        transcription_results = whisper_script.transcribe_audio(ctx.file, model_name=args.model, device=args.device, dtype=args.dtype,
+                                                                audio=ctx.decoded(), vad=args.vad, num_threads=args.threads,
+                                                                word_timestamps=args.word_timestamps, on_segment=writer.write)
+    end = time.time()
+    detected_language = transcription_results.get('language')
+
+    # Print the transcription
+    if "segments" not in transcription_results:
+        raise Exception("No transcription segments found.")
+    print("\n=== Transcription Complete ===")
+    print(f'\ntime taken: {end-start}\n')
+    print(f"Transcription saved to: {ctx.segments_path()}")
+    if args.verbose:
+        print(f'Detected language: {detected_language}')
+        for segment in transcription_results["segments"]:
+            start = segment['start']
+            end = segment['end']
+            text = segment['text']
+            print(f"[{start:.2f} --> {end:.2f}] {text}")
+    return {'language': detected_language,
+            'path': ctx.segments_path(),
+            'text_path': text_view,
+            'text': transcription_results.get('text'),
+            'segments': [transcripts.segment_record(segment) for segment in transcription_results["segments"]]}
+
+###################################
+#        Semantic Analysis        #
+###################################
+
+def semantics_stage(inputs, ctx):
+    transcription = inputs['transcribe']
+
+    # Initialize generator
+    analyzer = get_analyzer(ctx.client, transcription['language'])
+        # Analyze lyrics straight from the segments, keeping their timing
+    try:
         start = time.time()
-        audi_features = audio_analyzer.analyze()
+        semantics_results = analyzer.analyze_segments(transcription['segments'], source=ctx.segments_path())
         end = time.time()
-        print("\n=== Transcription Complete ===")
-        print(f"song features extarcted in {end - start} seconds")
-        if args.verbose:
-            for feature_name, feature_values in audi_features.items():
-                print(f"{feature_name}: {feature_values.shape if isinstance(feature_values, np.ndarray) else feature_values}")
 
-    if (not (args.mode == 'lyrical' or args.mode == 'instrumental' or args.mode == 'hybrid')):
-        print(f"\"{args.mode}\" is not a valid mode")
-        return
+        # Print results summary
+        print("\n=== Analysis Complete ===")
+        print(f"Time taken: {end-start}")
+        print(f"Sentiment: {semantics_results['hugging_sentiment']}")
+        if ctx.args.verbose:
+            for section in semantics_results['emotional_arc']:
+                valence = 'n/a' if section['valence'] is None else f"{section['valence']:+.2f}"
+                print(f"[{section['start']:.2f} --> {section['end']:.2f}] valence: {valence}")
+        print(f"\nFull analysis results saved to: {analyzer.output_dir}")
+        return semantics_results
+    except Exception:
+        print("Check the generated JSON file for details.")
+        raise
 
-    ###################################
-    #             GPT Test            #
-    ###################################
-    # try:
-    #     api_key = get_api_key()
-    #     client = OpenAI(api_key=api_key)
-
-    #     # Send a simple test request to GPT-4o
-    #     chat_completion = client.chat.completions.create(
-    #         messages=[
-    #             {
-    #                 "role": "user",
-    #                 "content": "Say this is a test",
-    #             }
-    #         ],
-    #         model="gpt-4o",
-    #     )
-
-    #     # Print the response from GPT-4o
-    #     print("\n")
-    #     print("GPT-4o response:", chat_completion.choices[0].message.content)
-
-    # except ValueError as ve:
-    #     print(f"ValueError: {ve}")
-    # except Exception as e:
-    #     # Catch and log any other errors
-    #     print(f"Error with GPT-4o: {e}")
-  
-    ###################################
-    #        Semantic Analysis        #
-    ###################################
-
-    if (args.depth > 1):
-         # api_key = os.getenv('OPENAI_API_KEY') # Get API key from environment variable for security
-        # if not api_key:
-        #     print(f"Please set the OPENAI_API_KEY environment variable")
-        #     return
-        api_key = get_api_key()
-        client = OpenAI(api_key=api_key)
-    if (args.depth > 1 and (args.mode == 'lyrical' or args.mode == 'hybrid')):
-        # Initialize generator
-        analyzer = sentiments_script.LyricAnalyzer(client, detected_language)
-            # Analyze lyrics
-        try:
-            start = time.time()
-            semantics_results = analyzer.analyze_lyrics(output_transcription)
-            end = time.time()
-            
-            # Print results summary
-            print("\n=== Analysis Complete ===")
-            print(f"Time taken: {end-start}")
-            print(f"Sentiment: {semantics_results['hugging_sentiment']}") 
-            print(f"\nFull analysis results saved to: {analyzer.output_dir}")
-        except Exception as e:
-            print(f"\nError: {str(e)}")
-            print("Check the generated JSON file for details.")
-    
-    ###################################
-    #        Prompt Generation        #
-    ###################################
-    if (args.depth > 2): # currently does not actually use sentiment, needs updating
-        try:
-            start = time.time()
-            if(args.mode == "lyrical"):
-                prompt = prompt_script.generate_art_prompt(client,
-                                                           text=semantics_results['original_lyrics'],
-                                                           analysis_results=semantics_results['detailed_analysis'],
-                                                           sentiment=semantics_results['hugging_sentiment'],
-                                                           model="gpt-3.5-turbo")
-            elif(args.mode == "instrumental"):
-                prompt = prompt_script.generate_art_prompt(client,
-                                                           instrumental_analysis=audi_features,
-                                                           model="gpt-3.5-turbo")
-            else: # hybrid
-                prompt = prompt_script.generate_art_prompt(client, 
-                                                           text=semantics_results['original_lyrics'], 
-                                                           analysis_results=semantics_results['detailed_analysis'], 
-                                                           sentiment=semantics_results['hugging_sentiment'], 
-                                                           instrumental_analysis=audi_features, 
-                                                           model="gpt-3.5-turbo")
-            end = time.time()
-            print("\n=== Prompt Generation Complete ===")
-            print(f"Time taken: {end-start}")
-            if args.verbose:
-                print("--------------------")
-                print(prompt)
-                print("--------------------")
-        except Exception as e:
-            print(f"\nError: {str(e)}")
-    
-    ###################################
-    #         Image Generation        #
-    ###################################
+###################################
+#       Instrumental Analysis     #
+###################################
+
+def spectrogram_stage(inputs, ctx):
+    # rendered in the stage's own thread: the graph already overlaps it with the features and lyrical stages
+    start = time.time()
+    output_image = ctx.audio_analyzer().create_mel_spectrogram(f'spectograms/{ctx.song_name}.png',
+                                                               annotated=ctx.args.annotate)
+    end = time.time()
+    if output_image is None:
+        raise Exception("Spectrogram could not be generated.")
+    print(f"mel spectogram created in {end - start} seconds")
+    return output_image
+
+def features_stage(inputs, ctx):
+    import numpy as np
+    audio_analyzer = ctx.audio_analyzer()
+    start = time.time()
+    audi_features = audio_analyzer.analyze_streaming() if ctx.args.stream else audio_analyzer.analyze()
+    end = time.time()
+    print("\n=== Transcription Complete ===")
+    print(f"song features extarcted in {end - start} seconds")
+    if ctx.args.verbose:
+        for feature_name, feature_values in audi_features.items():
+            print(f"{feature_name}: {feature_values.shape if isinstance(feature_values, np.ndarray) else feature_values}")
+    return audi_features
+
+###################################
+#        Prompt Generation        #
+###################################
+
+def prompt_stage(inputs, ctx):
+    import prompt_script
+    start = time.time()
+    semantics_results = inputs.get('semantics')
+    lyrical = {}
+    if semantics_results is not None:
+        lyrical = {'text': semantics_results['original_lyrics'],
+                   'analysis_results': semantics_results['detailed_analysis'],
+                   'sentiment': semantics_results['hugging_sentiment'],
+                   'emotional_arc': semantics_results.get('emotional_arc')}
+    prompt = prompt_script.generate_art_prompt(ctx.client,
+                                               instrumental_analysis=inputs.get('features'),
+                                               model="gpt-3.5-turbo",
+                                               **lyrical)
+    end = time.time()
+    print("\n=== Prompt Generation Complete ===")
+    print(f"Time taken: {end-start}")
+    if ctx.args.verbose:
+        print("--------------------")
+        print(prompt)
+        print("--------------------")
+    return prompt
+
+###################################
+#         Image Generation        #
+###################################
+
+def image_stage(inputs, ctx):
+    import art_script
+    start = time.time()
+    img_path = art_script.generate_image_with_dalle(inputs['prompt'], ctx.client, f"{ctx.song_name}_({ctx.args.mode})")
+    end = time.time()
+    print("\n=== Image Generation Complete ===")
+    print(f"Time taken: {end-start}")
+    print(f"Image path: {img_path}")
+    return img_path
+
+def build_graph(args):
+    """Stage graph of the selected mode: transcribe -> semantics -> prompt -> image, plus the audio features."""
+    prompt_deps = {'lyrical': ['semantics'], 'instrumental': ['features'], 'hybrid': ['semantics', 'features']}[args.mode]
+    stages = [
+        Stage('transcribe', transcribe_stage, params={'model': args.model, 'vad': args.vad, 'device': args.device,
+                                                      'dtype': args.dtype, 'word_timestamps': args.word_timestamps,
+                                                      'text_view': not args.no_text_view},
+              branch='lyrical', check=_transcript_exists, version=2),
+        Stage('semantics', semantics_stage, deps=['transcribe'], params={'model': 'gpt-4o'}, branch='lyrical', version=2),
+        Stage('spectrogram', spectrogram_stage, params={'annotate': args.annotate}, branch='instrumental', check=_file_exists),
+        Stage('features', features_stage, params={'stream': args.stream}, branch='instrumental'),
+        Stage('prompt', prompt_stage, deps=prompt_deps, params={'mode': args.mode, 'model': 'gpt-3.5-turbo'}),
+        Stage('image', image_stage, deps=['prompt'], params={'model': 'dall-e-3'}, check=_file_exists),
+    ]
+    return StageGraph(stages, force=args.force)
+
+def stage_targets(args):
+    """Stages to produce for the selected mode and depth."""
+    targets = []
+    if (args.mode == 'lyrical' or args.mode == 'hybrid'):
+        targets.append('semantics' if args.depth > 1 else 'transcribe')
+    if (args.mode == 'instrumental' or args.mode == 'hybrid'):
+        targets.append('features')
+        if not args.stream: # a spectrogram image of a whole long recording is not useful
+            targets.append('spectrogram')
+    if (args.depth > 2):
+        targets.append('prompt')
     if (args.depth > 3):
-        try:
-            start = time.time()
-            img_path = art_script.generate_image_with_dalle(prompt, client, f"{song_name}_({args.mode})")
-            end = time.time()
-            print("\n=== Image Generation Complete ===")
-            print(f"Time taken: {end-start}")
-            print(f"Image path: {img_path}")
-        except Exception as e:
-            print(f"\nError: {str(e)}")
+        targets.append('image')
+    return targets
+
+def song_outputs(values):
+    """Files written by the stages that succeeded, as absolute paths, plus the art prompt."""
+    outputs = {}
+    transcription = values.get('transcribe')
+    if transcription:
+        outputs['transcript'] = os.path.abspath(transcription['path'])
+        if transcription.get('text_path'):
+            outputs['transcript_text'] = os.path.abspath(transcription['text_path'])
+    if values.get('spectrogram'):
+        outputs['spectrogram'] = os.path.abspath(values['spectrogram'])
+    prompt = values.get('prompt')
+    if isinstance(prompt, dict) and prompt.get('main_prompt'):
+        outputs['prompt'] = prompt['main_prompt']
+    if values.get('image'):
+        outputs['image'] = os.path.abspath(values['image'])
+    return outputs
+
+def run_song(file, args, client=None):
+    """
+    Run the selected pipeline on a single song, reusing the stored artifact of every stage whose inputs are unchanged.
+
+    Args:
+        file (str): Path to the audio file.
+        args (argparse.Namespace): Parsed command-line options.
+        client (llm_client.RequestLayer): Request layer to reuse, created on demand when None.
+    Returns:
+        dict: Per-song report with 'song', 'status', 'stages' (ran, cached, failed or skipped),
+              'timings' (seconds per stage and branch), 'outputs' (see song_outputs), 'elapsed' and 'errors'.
+    """
+    report = {'song': file, 'status': 'ok', 'stages': {}, 'timings': {}, 'errors': []}
+    song_start = time.time()
+
+    print(f"\n\nfile: {file}")
+    if (args.depth > 1 and client is None):
+        client = make_client(cache_mode=args.llm_cache)
+
+    # the lyrical and instrumental branches are independent until prompt generation and run concurrently
+    context = SongContext(file, args, client, report)
+    from decoded_audio import file_digest
+    values = build_graph(args).run(file_digest(file), stage_targets(args), context, report)
+    report['outputs'] = song_outputs(values)
+
+    timings = report['timings']
+    if 'lyrical_branch' in timings and 'instrumental_branch' in timings:
+        print(f"\nbranches completed (lyrical: {timings['lyrical_branch']:.2f}s, instrumental: {timings['instrumental_branch']:.2f}s)")
+
+    report['elapsed'] = time.time() - song_start
+    if report['errors']:
+        report['status'] = 'error'
+    return report
+
+###################################
+#         Startup Profiling       #
+###################################
+
+def required_modules(args):
+    """Stage modules the selected mode and depth import, in the order the pipeline first needs them."""
+    modules = ['decoded_audio']
+    if (args.mode == 'lyrical' or args.mode == 'hybrid'):
+        # whisper_script resamples to 16 kHz through decoded_audio, which imports librosa when the song is loaded
+        modules += ['whisper_script', 'librosa']
+        if args.depth > 1:
+            modules.append('sentiments_script')
+    if (args.mode == 'instrumental' or args.mode == 'hybrid'):
+        modules.append('instrumentals_script')
+    if args.depth > 1:
+        modules.append('llm_client')
+    if args.depth > 2:
+        modules.append('prompt_script')
+    if args.depth > 3:
+        modules.append('art_script')
+    return modules
+
+# "import time: self [us] | cumulative | imported package" lines written to stderr by -X importtime
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+def import_report(args, top=15):
+    """
+    Import main and the modules the selected mode and depth need in a fresh interpreter under -X importtime,
+    then print the total and the slowest modules.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line options; import_budget is the allowed total in ms.
+        top (int): Number of modules to list.
+    Returns:
+        bool: False when the imports failed or exceeded the budget.
+    """
+    modules = required_modules(args)
+    code = f"import main, importlib\nfor name in {modules!r}: importlib.import_module(name)"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us) / 1000, int(cumulative_us) / 1000, len(indent) // 2))
+    if result.returncode != 0:
+        print(f"Error: import failed:\n{result.stderr.splitlines()[-1] if result.stderr else ''}")
+        return False
+
+    # top-level entries (depth 0) add up to the whole startup cost
+    total = sum(cumulative for _, _, cumulative, depth in entries if depth == 0)
+    cumulative_of = {name: cumulative for name, _, cumulative, _ in entries}
+    print(f"\n=== Import Report ({args.mode}, depth {args.depth}) ===")
+    print(f"modules: main, {', '.join(modules)}")
+    for name in ['main'] + modules:
+        if name in cumulative_of:
+            print(f"{name:<22} {cumulative_of[name]:>9.1f} ms")
+    print("\nslowest modules (self time):")
+    for name, self_ms, cumulative, _ in sorted(entries, key=lambda entry: entry[1], reverse=True)[:top]:
+        print(f"{name:<40} self: {self_ms:>8.1f} ms  cumulative: {cumulative:>8.1f} ms")
+    print(f"\ntotal import time: {total:.1f} ms")
+
+    if args.import_budget is not None and total > args.import_budget:
+        print(f"Error: import time {total:.1f} ms exceeds the budget of {args.import_budget:.1f} ms")
+        return False
+    return True
 
 def get_api_key(file_path="api_key.txt"):
     try:
@@ -208,6 +460,6 @@ def get_api_key(file_path="api_key.txt"):
     except Exception as e:
         print(f"An error occurred: {e}")
         return None
-   
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,69 @@
+# lyric text normalization shared by the WER evaluation, the lyrics extraction and the corpus store
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+# bump when the output of normalize changes, so stored normalized text gets recomputed
+VERSION = 2
+
+_TAGS = re.compile(r"\[.*?\]") # [Verse 1], [Chorus], whisper's [Music], ...
+
+# Arabic (see LyricAnalyzer's 'ar' model): diacritics and tatweel dropped, alef variants unified
+_ARABIC = {cp: None for cp in range(0x064B, 0x0653)} # fathatan .. sukun, maddah
+_ARABIC.update({0x0670: None, 0x0640: None}) # superscript alef, tatweel
+_ARABIC.update({ord(alef): 'ا' for alef in 'أإآٱ'})
+
+class _Table(dict):
+    """str.translate table that classifies each code point on first sight and remembers it."""
+    def __missing__(self, cp):
+        category = unicodedata.category(chr(cp))
+        if category == 'Pd' or category[0] == 'Z':
+            value = ' ' # dashes and unusual spaces separate words
+        elif category[0] == 'P':
+            value = None # any other punctuation, in any script, is removed
+        else:
+            value = cp
+        self[cp] = value
+        return value
+
+_TABLE = _Table(_ARABIC)
+
+# normalized text keyed by a digest of the input, least recently used dropped first
+_MEMO = OrderedDict()
+_MEMO_SIZE = 4096
+_MEMO_LOCK = threading.Lock()
+
+def strip_tags(text):
+    """Remove section tags like [Verse 1] or [Chorus]."""
+    return _TAGS.sub("", text).strip()
+
+def _normalize(text, lowercase):
+    words = _TAGS.sub(" ", text).translate(_TABLE).split()
+    normalized = " ".join(words)
+    return normalized.casefold() if lowercase else normalized
+
+def normalize(text, lowercase=False):
+    """
+    Normalize lyrics or a transcript for comparison in one pass: section tags removed, punctuation of every
+    script removed (dashes become spaces), Arabic diacritics and tatweel removed and alef forms unified,
+    and all whitespace (line breaks included) collapsed to single spaces. Results are memoized by content hash.
+
+    Args:
+        text (str): Text to normalize.
+        lowercase (bool): Also casefold the text.
+    Returns:
+        str: The normalized text.
+    """
+    key = (hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest(), lowercase)
+    with _MEMO_LOCK:
+        if key in _MEMO:
+            _MEMO.move_to_end(key)
+            return _MEMO[key]
+    normalized = _normalize(text, lowercase)
+    with _MEMO_LOCK:
+        _MEMO[key] = normalized
+        if len(_MEMO) > _MEMO_SIZE:
+            _MEMO.popitem(last=False)
+    return normalized
@@ -1,6 +1,17 @@
 import json
 
-def generate_art_prompt(client, text=None, sentiment=None, analysis_results=None, instrumental_analysis=None, model="gpt-3.5-turbo"):
+def describe_arc(emotional_arc):
+        """Render the sections of an emotional arc as lines like "0:00-0:45 negative (-0.62)"."""
+        lines = []
+        for section in emotional_arc:
+             if section['valence'] is None:
+                  continue
+             mood = "positive" if section['valence'] > 0.25 else "negative" if section['valence'] < -0.25 else "mixed"
+             span = f"{int(section['start']) // 60}:{int(section['start']) % 60:02d}-{int(section['end']) // 60}:{int(section['end']) % 60:02d}"
+             lines.append(f"{span} {mood} ({section['valence']:+.2f})")
+        return "\n".join(lines)
+
+def generate_art_prompt(client, text=None, sentiment=None, analysis_results=None, instrumental_analysis=None, emotional_arc=None, model="gpt-3.5-turbo"):
         """Generate an art prompt based on the analysis."""
         if text:
              o_text = f"Original Lyrics:\n{text}"
@@ -8,6 +19,8 @@ def generate_art_prompt(client, text=None, sentiment=None, analysis_results=None
              o_text = ""
         if sentiment:
              o_text = f"Sentiment:\n{sentiment}" + o_text
+        if emotional_arc:
+             o_text = f"Emotional Arc (how the mood of the lyrics moves through the song):\n{describe_arc(emotional_arc)}\n" + o_text
         if analysis_results:
              lyrical = f"Lyrical Analysis:\n{analysis_results}"
         else:
@@ -24,7 +37,7 @@ def generate_art_prompt(client, text=None, sentiment=None, analysis_results=None
 {o_text}
 
 Create a detailed, vivid prompt that:
-1. Captures the essence and emotion of the lyrics or music
+1. Captures the essence and emotion of the lyrics or music, including how the mood develops
 2. Incorporates major themes and imagery
 3. Suggests specific visual elements, colors, and composition
 4. Maintains artistic cohesion
@@ -42,7 +55,7 @@ Format the response as a JSON object with these keys:
 - key_elements: list of important visual elements to include"""
 
         try:
-            response = client.chat.completions.create(
+            response = client.chat(
                 model=model,
                 messages=[
                     {"role": "system", "content": "You are an expert at creating artistic prompts that capture the essence of literary works."},
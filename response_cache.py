@@ -0,0 +1,111 @@
+# content-addressed on-disk cache of OpenAI chat responses
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", "cache/llm_responses.sqlite")
+
+# readwrite: serve hits and store misses; readonly: serve hits, never write;
+# replay: serve hits regardless of age and fail on a miss (offline, reproducible runs); off: no caching
+MODES = ('readwrite', 'readonly', 'replay', 'off')
+
+class CacheMiss(Exception):
+    """Raised in replay mode when a request has no cached response."""
+
+def request_key(model, messages, response_format=None, **params):
+    """SHA-256 of everything that determines a response: model, messages, response_format and other parameters."""
+    request = {'model': model, 'messages': messages, 'response_format': response_format, 'params': params}
+    encoded = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, mode='readwrite', ttl=30 * 24 * 3600, max_entries=100000, max_mb=512):
+        """
+        Args:
+            path (str): SQLite database file.
+            mode (str): One of MODES.
+            ttl (float): Seconds a response stays valid (ignored in replay mode), None to keep forever.
+            max_entries (int): Maximum number of stored responses.
+            max_mb (float): Maximum total size of stored responses in megabytes.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode '{mode}', expected one of {MODES}")
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if mode == 'off':
+            return
+
+        if mode == 'readwrite':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        elif not os.path.isfile(path):
+            return # nothing cached yet, every lookup misses
+        # several batch workers share the file; WAL lets readers proceed while one of them writes
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        if mode == 'readwrite':
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, model TEXT, payload TEXT, size INTEGER, created REAL, last_used REAL)""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self._db.commit()
+
+    def get(self, key):
+        """Return the cached payload for key, None on a miss (CacheMiss in replay mode)."""
+        payload = None
+        if self._db is not None:
+            with self._lock:
+                row = self._db.execute("SELECT payload, created FROM responses WHERE key = ?", (key,)).fetchone()
+                expired = row is not None and self.mode != 'replay' and self.ttl is not None and time.time() - row[1] > self.ttl
+                if row is not None and not expired:
+                    payload = row[0]
+                    if self.mode == 'readwrite':
+                        self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+                        self._db.commit()
+        if payload is None:
+            self.misses += 1
+            if self.mode == 'replay':
+                raise CacheMiss(f"No cached response for request {key[:12]} (replay mode)")
+            return None
+        self.hits += 1
+        return payload
+
+    def put(self, key, model, payload):
+        """Store a payload and evict expired and least recently used entries beyond the size bounds."""
+        if self.mode != 'readwrite':
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, model, payload, len(payload.encode('utf-8')), now, now))
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # walk from the least recently used entry until both bounds hold
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
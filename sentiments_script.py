@@ -1,46 +1,174 @@
 from transformers import pipeline
 import json
+import threading
+import numpy as np
 from datetime import datetime
 from pathlib import Path
+import transcripts
+
+#ISO 639-1 two-letter language codes
+SENTIMENT_MODELS = {
+    'en': "distilbert-base-uncased-finetuned-sst-2-english",
+    'ar': "PRAli22/AraBert-Arabic-Sentiment-Analysis",
+}
+DEFAULT_SENTIMENT_MODEL = "distilbert-base-multilingual-cased"
+SENTIMENT_BATCH_SIZE = 16
+
+# text-classification pipelines shared by every LyricAnalyzer in the process, keyed by model name
+_PIPELINES = {}
+_PIPELINES_LOCK = threading.Lock()
+
+def get_pipeline(language):
+    """Return the process-wide sentiment pipeline for a language, loading it on first use."""
+    model_name = SENTIMENT_MODELS.get(language, DEFAULT_SENTIMENT_MODEL)
+    with _PIPELINES_LOCK:
+        if model_name not in _PIPELINES:
+            _PIPELINES[model_name] = pipeline("text-classification", model=model_name)
+        return _PIPELINES[model_name]
+
+def chunk_lyrics(text, tokenizer, max_tokens=None):
+    """
+    Split lyrics into chunks that fit the model's token window, packing whole lines (transcript segments)
+    together and only cutting a line when it is longer than the window by itself.
+
+    Args:
+        text (str): Lyrics, one segment per line.
+        tokenizer (PreTrainedTokenizerFast): Tokenizer of the sentiment model.
+        max_tokens (int): Tokens per chunk, defaults to the model's limit minus its special tokens.
+    Returns:
+        list: (chunk text, token count) pairs in lyric order.
+    """
+    if max_tokens is None:
+        max_tokens = min(tokenizer.model_max_length, 512) - tokenizer.num_special_tokens_to_add()
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+    # one tokenizer call for every line; the offsets map token windows back to the original text
+    encoded = tokenizer(lines, add_special_tokens=False, return_offsets_mapping=True)
+
+    chunks, current, current_tokens = [], [], 0
+    def flush():
+        if current:
+            chunks.append(("\n".join(current), current_tokens))
+    for line, offsets in zip(lines, encoded['offset_mapping']):
+        if not offsets:
+            continue
+        if current_tokens + len(offsets) > max_tokens:
+            flush()
+            current, current_tokens = [], 0
+        if len(offsets) > max_tokens:
+            for start in range(0, len(offsets), max_tokens):
+                window = offsets[start:start + max_tokens]
+                chunks.append((line[window[0][0]:window[-1][1]], len(window)))
+            continue
+        current.append(line)
+        current_tokens += len(offsets)
+    flush()
+    return chunks
+
+def aggregate_scores(chunk_scores, weights):
+    """
+    Combine per-chunk label distributions into one, weighting each chunk by its length.
+
+    Args:
+        chunk_scores (list): Per chunk, a list of {'label', 'score'} covering every label (pipeline top_k=None).
+        weights (list): Weight of each chunk, e.g. its token count.
+    Returns:
+        dict: 'label' and 'score' of the strongest label, plus 'scores' (label -> weighted score) and 'chunks'.
+    """
+    total = float(sum(weights))
+    scores = {}
+    for chunk, weight in zip(chunk_scores, weights):
+        for entry in chunk:
+            scores[entry['label']] = scores.get(entry['label'], 0.0) + entry['score'] * weight / total
+    label = max(scores, key=scores.get)
+    return {'label': label, 'score': scores[label], 'scores': scores, 'chunks': len(chunk_scores)}
+
+def label_valence(labels):
+    """+1 for positive labels, -1 for negative ones and 0 for neutral or unnamed (LABEL_n) ones."""
+    return np.array([1.0 if 'pos' in label.lower() else -1.0 if 'neg' in label.lower() else 0.0
+                     for label in labels], dtype=np.float32)
+
+def emotional_arc(timeline, sections=4):
+    """
+    Summarize a sentiment timeline into equal-length sections of the song.
+
+    Args:
+        timeline (dict): Output of LyricAnalyzer.sentiment_timeline.
+        sections (int): Number of sections to split the sung part of the song into.
+    Returns:
+        list: Per section, 'start' and 'end' in seconds and the duration-weighted mean 'valence' (None when nothing is sung).
+    """
+    start, end, valence = (np.asarray(timeline[key], dtype=np.float32) for key in ('start', 'end', 'valence'))
+    if len(start) == 0:
+        return []
+    edges = np.linspace(start[0], end[-1], sections + 1)
+    section = np.clip(np.searchsorted(edges, (start + end) / 2, side='right') - 1, 0, sections - 1)
+    duration = np.maximum(end - start, 1e-3)
+    weight = np.bincount(section, weights=duration, minlength=sections)
+    total = np.bincount(section, weights=valence * duration, minlength=sections)
+    return [{'start': float(edges[i]), 'end': float(edges[i + 1]),
+             'valence': float(total[i] / weight[i]) if weight[i] > 0 else None}
+            for i in range(sections)]
 
 class LyricAnalyzer:
     def __init__(self, client, language='unspecified'):
-        """Initialize with OpenAI API key and sentiment analyzer."""
+        """Initialize with the OpenAI request layer and the language's shared sentiment pipeline."""
         self.client = client
-        
-        #ISO 639-1 two-letter language codes
-        if (language == 'en'):
-            self.sentiment_pipeline = pipeline(
-                "text-classification", 
-                model="distilbert-base-uncased-finetuned-sst-2-english"
-            )
-        elif (language == 'ar'):
-            self.sentiment_pipeline = pipeline(
-                "text-classification",
-                model="PRAli22/AraBert-Arabic-Sentiment-Analysis"
-            )
-        else:
-            self.sentiment_pipeline = pipeline(
-                "text-classification", 
-                model="distilbert-base-multilingual-cased"
-            )
+        self.sentiment_pipeline = get_pipeline(language)
 
         self.output_dir = Path("analysis_results")
         self.output_dir.mkdir(exist_ok=True)
 
     def read_lyrics(self, file_path):
-        """Read lyrics file with proper encoding."""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-        except UnicodeDecodeError:
-            with open(file_path, 'r', encoding='cp1252') as file:
-                return file.read()
+        """Read the lyrics of a transcript, from its JSONL segments when they exist, else from the text file."""
+        return transcripts.load_text(file_path)
+
+    def get_sentiment(self, text, batch_size=SENTIMENT_BATCH_SIZE):
+        """
+        Sentiment of the whole lyrics: every token-window chunk is scored in batched forward passes
+        and the label distributions are averaged by chunk length, so nothing past the model's limit is dropped.
+        """
+        chunks = chunk_lyrics(text, self.sentiment_pipeline.tokenizer)
+        if not chunks:
+            return None
+        # truncation only guards against the special-token estimate being off by a few tokens
+        chunk_scores = self.sentiment_pipeline([chunk for chunk, _ in chunks], top_k=None,
+                                               batch_size=batch_size, truncation=True)
+        return aggregate_scores(chunk_scores, [tokens for _, tokens in chunks])
+
+    def sentiment_timeline(self, segments, batch_size=SENTIMENT_BATCH_SIZE):
+        """
+        Score every transcription segment in batched forward passes.
 
-    def get_sentiment(self, text):
-        """Get sentiment using previously determined model."""
-        results = self.sentiment_pipeline(text, truncation=True)
-        return results[0] if results else None
+        Args:
+            segments (list): Whisper segments with 'start', 'end' and 'text'.
+            batch_size (int): Segments per forward pass.
+        Returns:
+            dict: 'labels' (list), and arrays aligned with the non-empty segments: 'start', 'end' (seconds),
+                  'tokens' (token count), 'scores' (segments x labels probabilities) and 'valence' (positive minus negative).
+        """
+        segments = [segment for segment in segments if segment['text'].strip()]
+        texts = [segment['text'].strip() for segment in segments]
+        id2label = self.sentiment_pipeline.model.config.id2label
+        labels = [id2label[i] for i in range(len(id2label))]
+        column = {label: i for i, label in enumerate(labels)}
+
+        scores = np.zeros((len(texts), len(labels)), dtype=np.float32)
+        tokens = np.zeros(len(texts), dtype=np.int32)
+        if texts:
+            encoded = self.sentiment_pipeline.tokenizer(texts, add_special_tokens=False)
+            tokens[:] = [len(ids) for ids in encoded['input_ids']]
+            results = self.sentiment_pipeline(texts, top_k=None, batch_size=batch_size, truncation=True)
+            for row, entries in enumerate(results):
+                for entry in entries:
+                    scores[row, column[entry['label']]] = entry['score']
+        return {'labels': labels,
+                'start': np.array([segment['start'] for segment in segments], dtype=np.float32),
+                'end': np.array([segment['end'] for segment in segments], dtype=np.float32),
+                'tokens': tokens,
+                'scores': scores,
+                'valence': scores @ label_valence(labels)}
 
     def analyze_with_gpt(self, text):
         """Analyze lyrics using GPT for deeper understanding."""
@@ -61,7 +189,7 @@ Format the response as a JSON object with these categories as keys.
 Make the analysis rich and specific, but keep each point concise."""
 
         try:
-            response = self.client.chat.completions.create(
+            response = self.client.chat(
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": "You are a literary expert specialized in analyzing lyrics and poetry. Provide deep, insightful analysis while maintaining objectivity."},
@@ -134,28 +262,65 @@ Make the analysis rich and specific, but keep each point concise."""
             # Get English sentiment
             sentiment = self.get_sentiment(lyrics)
             results['hugging_sentiment'] = sentiment
-            
-            # Get GPT analysis
-            gpt_analysis = self.analyze_with_gpt(lyrics)
-            # print("detailed analysis")
-            # print(gpt_analysis)
-            gpt_analysis = gpt_analysis.choices[0].message.content
-            results['detailed_analysis'] = gpt_analysis
-            
-            # Save analysis results
+            return self._finish_analysis(lyrics, results)
+
+        except Exception as e:
+            results['error'] = str(e)
             self.save_analysis_results(results)
-            
-            return results
-            
+            raise
+
+    def analyze_segments(self, segments, source=None):
+        """
+        Semantic analysis straight from Whisper segments, without reading a transcript file back.
+        The per-segment scores give both the sentiment timeline and, weighted by length, the whole-song sentiment.
+
+        Args:
+            segments (list): Whisper segments with 'start', 'end' and 'text'.
+            source (str): Name of the song or transcript, recorded in the results.
+        Returns:
+            dict: Same keys as analyze_lyrics plus 'sentiment_timeline' and 'emotional_arc'.
+        """
+        results = {
+            'timestamp': datetime.now().isoformat(),
+            'input_file': source
+        }
+
+        try:
+            lyrics = "\n".join(segment['text'].strip() for segment in segments if segment['text'].strip())
+            results['original_lyrics'] = lyrics
+
+            timeline = self.sentiment_timeline(segments)
+            results['sentiment_timeline'] = timeline
+            results['emotional_arc'] = emotional_arc(timeline)
+            results['hugging_sentiment'] = aggregate_scores(
+                [[{'label': label, 'score': float(score)} for label, score in zip(timeline['labels'], row)]
+                 for row in timeline['scores']],
+                timeline['tokens'].tolist()) if len(timeline['tokens']) else None
+            return self._finish_analysis(lyrics, results)
+
         except Exception as e:
             results['error'] = str(e)
             self.save_analysis_results(results)
             raise
 
+    def _finish_analysis(self, lyrics, results):
+        # GPT analysis and saving, shared by both entry points
+        gpt_analysis = self.analyze_with_gpt(lyrics)
+        # print("detailed analysis")
+        # print(gpt_analysis)
+        gpt_analysis = gpt_analysis.choices[0].message.content
+        results['detailed_analysis'] = gpt_analysis
+
+        # Save analysis results
+        self.save_analysis_results(results)
+
+        return results
+
     def save_analysis_results(self, results):
         """Save analysis results to a JSON file."""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         results_path = self.output_dir / f"analysis_results_{timestamp}.json"
         
         with open(results_path, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
\ No newline at end of file
+            # timeline arrays are written as plain lists
+            json.dump(results, f, ensure_ascii=False, indent=2, default=lambda value: value.tolist())
\ No newline at end of file
@@ -0,0 +1,223 @@
+# long-lived inference server: keeps the models warm and takes songs as jobs over a local HTTP endpoint
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+import uuid
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+class InferenceServer:
+    def __init__(self, workers=1):
+        """
+        Args:
+            workers (int): Jobs processed at the same time (threads sharing the resident models).
+        """
+        import main # the heavy stage modules are imported once, here, and stay loaded
+        self.main = main
+        self.parser = main.build_parser()
+        # OpenAI request layers per response cache mode, created by the first job that calls the API,
+        # so the server starts without an API key and --depth 1 jobs never need one
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self.jobs = {}
+        self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def warm_up(self, whisper_models=("turbo",), languages=("en",)):
+        """Load the Whisper models and sentiment pipelines up front so the first job doesn't pay for them."""
+        import whisper_script
+        for model_name in whisper_models:
+            print(f"Loading whisper model: {model_name}")
+            whisper_script.get_model(model_name)
+        for language in languages:
+            print(f"Loading sentiment pipeline: {language}")
+            self.main.get_analyzer(None, language) # each job hands the analyzer its own client
+
+    def client(self, cache_mode):
+        """Shared request layer of the given response cache mode."""
+        with self._clients_lock:
+            if cache_mode not in self._clients:
+                self._clients[cache_mode] = self.main.make_client(cache_mode=cache_mode)
+            return self._clients[cache_mode]
+
+    def close(self):
+        with self._clients_lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+    def submit(self, argv):
+        """Queue a job given main.py's command-line arguments; returns the job id."""
+        args = self.parser.parse_args(argv)
+        if args.file is None:
+            self.parser.error("the following arguments are required: file")
+        job = {'id': uuid.uuid4().hex, 'argv': argv, 'file': args.file, 'status': 'queued',
+               'submitted': time.time(), 'started': None, 'finished': None, 'report': None}
+        with self._lock:
+            self.jobs[job['id']] = job
+        self.queue.put((job, args))
+        return job['id']
+
+    def job(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def status(self):
+        with self._lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {'status': 'ok', 'workers': len(self.threads), 'jobs': counts}
+
+    def _work(self):
+        while True:
+            job, args = self.queue.get()
+            job['status'] = 'running'
+            job['started'] = time.time()
+            try:
+                # the job's own --llm-cache picks the request layer
+                client = self.client(args.llm_cache) if args.depth > 1 else None
+                report = self.main.run_song(args.file, args, client)
+            except Exception as e:
+                report = {'song': args.file, 'status': 'error', 'timings': {}, 'errors': [str(e)]}
+            job['report'] = report
+            job['finished'] = time.time()
+            job['status'] = 'done' if report['status'] == 'ok' else 'failed'
+            self.queue.task_done()
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "SongCanvas/1.0"
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        inference = self.server.inference
+        if self.path == "/health":
+            self._reply(200, inference.status())
+        elif self.path.startswith("/jobs/"):
+            job = inference.job(self.path[len("/jobs/"):])
+            if job is None:
+                self._reply(404, {'error': 'unknown job'})
+            else:
+                self._reply(200, job)
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self._reply(404, {'error': 'not found'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            job_id = self.server.inference.submit(body['argv'])
+        except SystemExit: # argparse rejected the arguments
+            self._reply(400, {'error': 'invalid arguments'})
+        except (ValueError, KeyError) as e:
+            self._reply(400, {'error': str(e)})
+        else:
+            self._reply(202, {'id': job_id})
+
+    def log_message(self, format, *args): # keep the console for the pipeline's own output
+        pass
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=1, whisper_models=("turbo",), languages=("en",)):
+    inference = InferenceServer(workers=workers)
+    inference.warm_up(whisper_models, languages)
+    httpd = ThreadingHTTPServer((host, port), _Handler)
+    httpd.inference = inference
+    print(f"Inference server listening on http://{host}:{port} with {workers} worker(s)")
+    # the stages write relative paths (lyric_results/, spectograms/, ...), so jobs land under the server's directory
+    print(f"Results are written under {os.getcwd()}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        inference.close()
+
+###################################
+#              Client             #
+###################################
+
+def _request(port, path, body=None, timeout=10.0):
+    url = f"http://{DEFAULT_HOST}:{port}{path}"
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def server_running(port=DEFAULT_PORT):
+    """Whether an inference server answers on the local port."""
+    try:
+        return _request(port, "/health", timeout=0.5).get('status') == 'ok'
+    except (OSError, ValueError):
+        return False
+
+def print_outputs(report):
+    """Print the files (absolute paths) and prompt a song run produced."""
+    for name, value in report.get('outputs', {}).items():
+        print(f"    {name}: {value}")
+
+def submit_and_wait(songs, argv, target, port=DEFAULT_PORT, poll_interval=0.5):
+    """
+    Submit one job per song, reusing the CLI arguments, and wait for all of them.
+
+    Args:
+        songs (list): Paths of the songs.
+        argv (list): Command-line arguments of main.py; target is replaced by each song's absolute path.
+        target (str): The file argument as given on the command line.
+        port (int): Port of the inference server.
+    Returns:
+        list: The song reports, in completion order.
+    """
+    import batch_script
+    start = time.time()
+    pending = {}
+    for song in songs:
+        song_argv = [os.path.abspath(song) if arg == target else arg for arg in argv]
+        pending[_request(port, "/jobs", {'argv': song_argv})['id']] = song
+
+    reports = []
+    while pending:
+        time.sleep(poll_interval)
+        for job_id in list(pending):
+            job = _request(port, f"/jobs/{job_id}")
+            if job['status'] in ('done', 'failed'):
+                del pending[job_id]
+                reports.append(job['report'])
+                batch_script.print_status(job['report'], len(reports), len(songs))
+                print_outputs(job['report'])
+    if len(songs) > 1:
+        batch_script.print_summary(reports, time.time() - start)
+    return reports
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the SongCanvas models warm and serve main.py jobs locally.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on (localhost only)")
+    parser.add_argument("--workers", type=int, default=1, help="jobs processed at the same time")
+    parser.add_argument("--preload", type=str, nargs="*", default=["turbo"], help="whisper models to load at startup")
+    parser.add_argument("--languages", type=str, nargs="*", default=["en"], help="sentiment pipelines to load at startup")
+    parser.add_argument("-w","--warnings", action='store_true', help="unsuppress warnings")
+    args = parser.parse_args()
+
+    if not args.warnings:
+        warnings.filterwarnings("ignore")
+    serve(port=args.port, workers=args.workers, whisper_models=args.preload, languages=args.languages)
@@ -0,0 +1,171 @@
+# explicit stage graph of the pipeline with content-hashed artifacts, so finished stages are reused
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+ARTIFACT_DIR = "artifacts"
+
+def _to_json(value):
+    # numpy scalars and arrays (librosa features, whisper segments) are stored as plain numbers and lists
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def content_hash(value):
+    """SHA-256 of a JSON-serializable value."""
+    encoded = json.dumps(value, sort_keys=True, ensure_ascii=False, default=_to_json)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+class Stage:
+    def __init__(self, name, run, deps=(), params=None, branch=None, check=None, version=1):
+        """
+        Args:
+            name (str): Unique stage name.
+            run (callable): run(inputs, context) -> JSON-serializable value; inputs maps dependency names to their values.
+            deps (tuple): Names of the stages whose outputs this stage consumes.
+            params (dict): Settings that change the output (model name, mode, ...), part of the artifact key.
+            branch (str): Branch the stage belongs to, for per-branch timings.
+            check (callable): check(value) -> bool, False when a reused artifact's side effects (e.g. files) are gone.
+            version (int): Bump to invalidate artifacts after changing the stage's code.
+        """
+        self.name = name
+        self.run = run
+        self.deps = tuple(deps)
+        self.params = params or {}
+        self.branch = branch
+        self.check = check
+        self.version = version
+
+    def key(self, source_hash, dep_hashes):
+        """Artifact key: hash of the stage, its parameters and the content hashes of everything it reads."""
+        inputs = {dep: dep_hashes[dep] for dep in self.deps} if self.deps else {'source': source_hash}
+        return content_hash({'stage': self.name, 'version': self.version, 'params': self.params, 'inputs': inputs})
+
+class StageGraph:
+    def __init__(self, stages, artifact_dir=ARTIFACT_DIR, max_workers=3, force=False):
+        """
+        Args:
+            stages (list): Stage objects; dependencies must be part of the list.
+            artifact_dir (str): Folder of the stored artifacts.
+            max_workers (int): Stages that may run at the same time once their inputs are ready.
+            force (bool): Recompute every stage even when its artifact exists.
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.artifact_dir = artifact_dir
+        self.max_workers = max_workers
+        self.force = force
+
+    def _required(self, targets):
+        required, todo = set(), list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in required:
+                required.add(name)
+                todo.extend(self.stages[name].deps)
+        return required
+
+    def _artifact_path(self, stage, key):
+        return os.path.join(self.artifact_dir, stage.name, f"{key}.json")
+
+    def _load(self, stage, key):
+        path = self._artifact_path(stage, key)
+        if self.force or not os.path.isfile(path):
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                artifact = json.load(f)
+        except (OSError, ValueError): # partially written by a crashed run
+            return None
+        if stage.check is not None and not stage.check(artifact['value']):
+            return None
+        return artifact
+
+    def _store(self, stage, key, value):
+        # the output is serialized before hashing so the stored value and its hash always agree
+        value = json.loads(json.dumps(value, ensure_ascii=False, default=_to_json))
+        artifact = {'stage': stage.name, 'key': key, 'params': stage.params, 'created': time.time(),
+                    'output_hash': content_hash(value), 'value': value}
+        path = self._artifact_path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(artifact, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return artifact
+
+    def _run_stage(self, stage, key, inputs, context):
+        artifact = self._load(stage, key)
+        if artifact is not None:
+            print(f"{stage.name}: unchanged inputs, reusing artifact {key[:12]}")
+            return artifact, 'cached', 0.0
+        start = time.time()
+        value = stage.run(inputs, context)
+        artifact = self._store(stage, key, value)
+        return artifact, 'ran', time.time() - start
+
+    def run(self, source_hash, targets, context, report):
+        """
+        Run the targets and everything they depend on, reusing stored artifacts whose inputs are unchanged.
+        Independent stages run concurrently; a failed stage skips only the stages that depend on it.
+
+        Args:
+            source_hash (str): Content hash of the song file.
+            targets (list): Names of the stages to produce.
+            context (object): Passed to every stage's run function.
+            report (dict): Song report; 'timings', 'stages' and 'errors' are filled in.
+        Returns:
+            dict: Stage name -> output value for every stage that succeeded.
+        """
+        required = self._required(targets)
+        values, hashes = {}, {}
+        statuses = report.setdefault('stages', {})
+        branch_spans = {}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                # skips propagate down whole chains of dependents, whatever order the stages are visited in
+                changed = True
+                while changed:
+                    changed = False
+                    for name in sorted(required - set(statuses) - set(running.values())):
+                        if any(statuses.get(dep) in ('failed', 'skipped') for dep in self.stages[name].deps):
+                            statuses[name] = 'skipped'
+                            changed = True
+                for name in sorted(required - set(statuses) - set(running.values())):
+                    stage = self.stages[name]
+                    if all(dep in hashes for dep in stage.deps):
+                        key = stage.key(source_hash, hashes)
+                        inputs = {dep: values[dep] for dep in stage.deps}
+                        future = pool.submit(self._run_stage, stage, key, inputs, context)
+                        running[future] = name
+                        if stage.branch:
+                            branch_spans.setdefault(stage.branch, [time.time(), None])
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    stage = self.stages[name]
+                    try:
+                        artifact, status, elapsed = future.result()
+                    except Exception as e:
+                        print(f"\nError in {name}: {str(e)}")
+                        statuses[name] = 'failed'
+                        report['errors'].append(f"{name}: {str(e)}")
+                    else:
+                        statuses[name] = status
+                        values[name] = artifact['value']
+                        hashes[name] = artifact['output_hash']
+                        if status == 'ran':
+                            report['timings'][name] = elapsed
+                    if stage.branch:
+                        branch_spans[stage.branch][1] = time.time()
+
+        for branch, (start, end) in branch_spans.items():
+            report['timings'][f'{branch}_branch'] = end - start
+        return values
@@ -0,0 +1,113 @@
+# structured transcript files: one JSON segment per line (JSONL), appended as the segments are decoded,
+# with the "[start --> end] text" format kept as an optional human-readable view
+import json
+import os
+import re
+import threading
+
+_TEXT_LINE = re.compile(r"^\[\s*([\d.]+)\s*-->\s*([\d.]+)\]\s?(.*)$")
+
+def segment_record(segment):
+    """Keep the fields of a Whisper segment worth storing, with word timings when they were computed."""
+    record = {'id': segment.get('id'), 'start': round(float(segment['start']), 3), 'end': round(float(segment['end']), 3),
+              'text': segment['text']}
+    for key in ('avg_logprob', 'no_speech_prob'):
+        if key in segment:
+            record[key] = round(float(segment[key]), 4)
+    if segment.get('words'):
+        record['words'] = [{'word': word['word'], 'start': round(float(word['start']), 3), 'end': round(float(word['end']), 3),
+                            'probability': round(float(word['probability']), 4)}
+                           for word in segment['words']]
+    return record
+
+def text_line(segment):
+    """Segment in the command-line tool's text format."""
+    return f"[{segment['start']:.2f} --> {segment['end']:.2f}] {segment['text']}\n"
+
+def jsonl_path(path):
+    """The JSONL transcript next to a text transcript (or any path with the same stem)."""
+    return os.path.splitext(path)[0] + '.jsonl'
+
+class SegmentWriter:
+    """Appends segments to a JSONL transcript (and optionally its text view) as soon as they are decoded."""
+    def __init__(self, path, text_path=None):
+        """
+        Args:
+            path (str): JSONL file to write.
+            text_path (str): Text view to write alongside, None to skip it.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.text_path = text_path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'w', encoding='utf-8')
+        self._text = open(text_path, 'w', encoding='utf-8') if text_path else None
+
+    def write(self, segment):
+        # flushed per segment so readers can follow a transcription in progress
+        with self._lock:
+            self._file.write(json.dumps(segment_record(segment), ensure_ascii=False) + '\n')
+            self._file.flush()
+            if self._text is not None:
+                self._text.write(text_line(segment))
+                self._text.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            if self._text is not None:
+                self._text.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_segments(path):
+    """
+    Read the segments of a JSONL transcript; a half-written last line of a transcript in progress is ignored.
+
+    Args:
+        path (str): JSONL transcript.
+    Returns:
+        list: Segment dicts with 'start', 'end', 'text' and, when recorded, 'words'.
+    """
+    segments = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                segments.append(json.loads(line))
+            except ValueError:
+                break
+    return segments
+
+def read_text_view(path):
+    """Parse the segments of a "[start --> end] text" transcript."""
+    segments = []
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = f.readlines()
+    except UnicodeDecodeError:
+        with open(path, encoding='cp1252') as f:
+            lines = f.readlines()
+    for line in lines:
+        match = _TEXT_LINE.match(line.rstrip('\n'))
+        if match:
+            segments.append({'start': float(match.group(1)), 'end': float(match.group(2)), 'text': match.group(3)})
+        elif line.strip(): # plain lyrics without timestamps
+            segments.append({'start': None, 'end': None, 'text': line.strip()})
+    return segments
+
+def load_segments(path):
+    """Segments of a transcript given either of its files, preferring the JSONL one over the text view."""
+    structured = path if path.endswith('.jsonl') else jsonl_path(path)
+    if os.path.isfile(structured):
+        return read_segments(structured)
+    return read_text_view(path)
+
+def load_text(path):
+    """Transcript text, one segment per line, without timestamps."""
+    return "\n".join(segment['text'].strip() for segment in load_segments(path))
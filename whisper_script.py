@@ -1,17 +1,312 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import torch
 import whisper
+from decoded_audio import DecodedAudio
+from transcripts import text_line
 
-def transcribe_audio(file_path, model_name="turbo", device="cuda"): 
+# Process-wide registry of loaded Whisper models, keyed by (model_name, device, weight dtype).
+# Models are loaded lazily on first use and stay resident until evicted (least recently used first)
+# to keep the total estimated size under the memory budget.
+_MODEL_CACHE = OrderedDict()
+_MODEL_SIZES = {}
+_CACHE_BUDGET_MB = float(os.getenv("WHISPER_CACHE_MB", 8192))
+# decoding installs kv-cache hooks on the model, so one model transcribes one song at a time
+_REGISTRY_LOCK = threading.RLock()
+_MODEL_LOCKS = {}
+
+def set_cache_budget(budget_mb):
+    """
+    Set the memory budget of the model registry and evict models that no longer fit.
+
+    Args:
+        budget_mb (float): Maximum total size of resident models in megabytes.
+    """
+    global _CACHE_BUDGET_MB
+    with _REGISTRY_LOCK:
+        _CACHE_BUDGET_MB = float(budget_mb)
+        _evict_models()
+
+def _model_size_mb(model):
+    # parameters and buffers are what actually stay resident; quantized layers keep their weights in packed
+    # params that the state dict exposes instead
+    size = sum(p.numel() * p.element_size() for p in model.parameters())
+    size += sum(b.numel() * b.element_size() for b in model.buffers())
+    for name, value in model.state_dict().items():
+        if name.endswith('_packed_params._packed_params'):
+            size += sum(t.numel() * t.element_size() for t in value if isinstance(t, torch.Tensor))
+    return size / (1024 * 1024)
+
+def _evict_models(keep=None):
+    # drop least recently used models until the registry fits the budget (the model in use is never dropped)
+    while sum(_MODEL_SIZES.values()) > _CACHE_BUDGET_MB:
+        key = next((k for k in _MODEL_CACHE if k != keep), None)
+        if key is None:
+            break
+        del _MODEL_CACHE[key]
+        del _MODEL_SIZES[key]
+        print(f"Evicted whisper model from cache: {key}")
+
+def resolve_device(device="auto", dtype="auto"):
+    """
+    Pick the device and precision: "auto" means CUDA with float16 decoding when a GPU is available,
+    otherwise CPU with int8-quantized linear layers. float16 is never used on CPU, where it isn't supported.
+
+    Returns:
+        tuple: (device, dtype)
+    """
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if dtype == "auto":
+        dtype = "float16" if device.startswith("cuda") else "int8"
+    elif dtype == "float16" and device == "cpu":
+        dtype = "float32"
+    return device, dtype
+
+def quantize_model(model):
+    """
+    Dynamically quantize the model's linear layers to int8 for CPU inference; convolutions, embeddings
+    and layer norms stay in float32.
+    """
+    # whisper's Linear subclass only casts weights to the input dtype; quantize_dynamic matches exact types,
+    # so the layers are turned back into plain nn.Linear first
+    for module in model.modules():
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def _registry_key(model_name, device, dtype):
+    # float16 only changes how the model decodes, so it shares the float32 weights
+    return (model_name, device, "int8" if dtype == "int8" else "float32")
+
+def get_model(model_name="turbo", device="auto", dtype="auto"):
+    """
+    Return a resident Whisper model, loading it on first use.
+
+    Args:
+        model_name (str): Whisper model to use ("small", "medium", "large", "turbo").
+        device (str): Device to load the model onto ("cuda", "cpu" or "auto").
+        dtype (str): Precision ("float32", "float16", "int8" (CPU only) or "auto", see resolve_device); float16
+            models keep float32 weights, which whisper casts per layer when decoding with fp16.
+    Returns:
+        whisper.model.Whisper: The loaded model.
+    """
+    device, dtype = resolve_device(device, dtype)
+    key = _registry_key(model_name, device, dtype)
+    with _REGISTRY_LOCK:
+        if key in _MODEL_CACHE:
+            _MODEL_CACHE.move_to_end(key)
+            return _MODEL_CACHE[key]
+
+        # no model.half(): whisper's LayerNorm runs in float32 and would get half-precision weights
+        model = whisper.load_model(model_name, device=device)
+        if dtype == "int8":
+            if device != "cpu":
+                raise ValueError("int8 quantization is only available on the CPU")
+            model = quantize_model(model)
+        _MODEL_CACHE[key] = model
+        _MODEL_SIZES[key] = _model_size_mb(model)
+        _evict_models(keep=key)
+        return model
+
+def _model_lock(key):
+    with _REGISTRY_LOCK:
+        return _MODEL_LOCKS.setdefault(key, threading.Lock())
+
+def transcribe_audio(file_path, model_name="turbo", device="auto", dtype="auto", audio=None, vad=False,
+                     batch_size=8, num_threads=None, word_timestamps=False, on_segment=None):
     """
     Args:
         file_path (str): Path to the audio file to transcribe.
         model_name (str): Whisper model to use ("small", "medium", "large", "turbo").
+        device (str): Device to run the model on ("cuda", "cpu" or "auto").
+        dtype (str): Weight precision ("float32", "float16", "int8" or "auto").
+        audio (DecodedAudio): Already decoded song, read from the decoded-audio cache when not given.
+        vad (bool): Skip non-vocal stretches and decode the remaining windows in batches (see transcribe_vad).
+        batch_size (int): Windows decoded together in VAD mode.
+        num_threads (int): Torch CPU threads to use, None to keep the current setting.
+        word_timestamps (bool): Add per-word 'words' (word, start, end, probability) to every segment.
+        on_segment (callable): Called with each segment as soon as it is final (per decoded batch in VAD mode,
+            after the whole song otherwise, as model.transcribe has no hook).
     Returns:
         dict: The transcription result containing keys like 'text', 'segments', etc.
     """
-    model = whisper.load_model(model_name, device=device)
-    result = model.transcribe(file_path)
+    device, dtype = resolve_device(device, dtype)
+    model = get_model(model_name, device=device, dtype=dtype)
+    if audio is None:
+        audio = DecodedAudio.load(file_path)
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    # half precision decoding only on the GPU; float32 and int8 models decode in float32
+    fp16 = dtype == "float16"
+    with _model_lock(_registry_key(model_name, device, dtype)):
+        if vad:
+            result = transcribe_vad(model, audio.for_whisper(), batch_size=batch_size, fp16=fp16,
+                                    word_timestamps=word_timestamps, on_segment=on_segment)
+        else:
+            result = model.transcribe(audio.for_whisper(), fp16=fp16, word_timestamps=word_timestamps)
+            if on_segment is not None:
+                for segment in result['segments']:
+                    on_segment(segment)
     return result
 
+###################################
+#     VAD-gated transcription     #
+###################################
+
+def voiced_regions(samples, sr=whisper.audio.SAMPLE_RATE, frame_seconds=0.032, threshold_db=-35.0, band=(250, 4000),
+                   min_voiced=0.25, min_gap=1.0, pad=0.2):
+    """
+    Energy-based voice activity detection: frames whose energy in the vocal band is within threshold_db
+    of the song's loud frames count as voiced, then short gaps are bridged and short blips dropped.
+
+    Args:
+        samples (np.ndarray): Mono float32 samples.
+        sr (int): Sample rate of the samples.
+        frame_seconds (float): Analysis frame length.
+        threshold_db (float): Level relative to the 95th percentile frame energy below which a frame is silent.
+        band (tuple): Frequency band in Hz the energy is measured in.
+        min_voiced (float): Voiced runs shorter than this many seconds are dropped.
+        min_gap (float): Silent gaps shorter than this many seconds are bridged.
+        pad (float): Seconds added on both sides of every region so word edges aren't cut.
+    Returns:
+        list: (start, end) sample indices of the voiced regions.
+    """
+    frame = int(sr * frame_seconds)
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return [(0, len(samples))] if len(samples) else []
+
+    window = np.hanning(frame).astype(np.float32)
+    freqs = np.fft.rfftfreq(frame, 1 / sr)
+    in_band = (freqs >= band[0]) & (freqs <= band[1])
+    energy_db = np.empty(n_frames, dtype=np.float32)
+    block = 4096 # frames per FFT call, keeps the spectra of long recordings out of memory
+    for start in range(0, n_frames, block):
+        frames = samples[start * frame:min(start + block, n_frames) * frame].reshape(-1, frame) * window
+        power = np.abs(np.fft.rfft(frames, axis=1)[:, in_band]) ** 2
+        energy_db[start:start + len(frames)] = 10 * np.log10(power.sum(axis=1) + 1e-10)
+    voiced = energy_db > np.percentile(energy_db, 95) + threshold_db
+
+    # runs of voiced frames as [start, end) frame indices
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], voiced.astype(np.int8), [0]))))
+    runs = edges.reshape(-1, 2).tolist()
+    merged = []
+    for start, end in runs:
+        if merged and (start - merged[-1][1]) * frame_seconds < min_gap:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    regions = []
+    for start, end in merged:
+        if (end - start) * frame_seconds < min_voiced:
+            continue
+        regions.append((max(0, start * frame - int(pad * sr)), min(len(samples), end * frame + int(pad * sr))))
+    return regions
+
+def plan_windows(regions, sr=whisper.audio.SAMPLE_RATE, window_seconds=whisper.audio.CHUNK_LENGTH):
+    """Group voiced regions into contiguous windows of at most window_seconds, splitting longer regions."""
+    limit = int(window_seconds * sr)
+    windows = []
+    for start, end in regions:
+        if windows and end - windows[-1][0] <= limit:
+            windows[-1][1] = end
+            continue
+        while end - start > limit:
+            windows.append([start, start + limit])
+            start += limit
+        windows.append([start, end])
+    return [tuple(window) for window in windows]
+
+def _parse_timestamped(tokens, tokenizer, duration):
+    # tokens look like <|0.00|> text <|2.40|><|2.40|> text <|5.00|>: every timestamp closes the text before it,
+    # and text left after the last timestamp runs to the end of the window
+    segments, last, text_tokens = [], 0.0, []
+    for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+            seconds = (token - tokenizer.timestamp_begin) * 0.02
+            if text_tokens:
+                segments.append((last, seconds, text_tokens))
+                text_tokens = []
+            last = seconds
+        else:
+            text_tokens.append(token)
+    if text_tokens:
+        segments.append((last, duration, text_tokens))
+    return [(start, end, tokenizer.decode(text_tokens), text_tokens) for start, end, text_tokens in segments]
+
+def transcribe_vad(model, samples, batch_size=8, fp16=False, language=None,
+                   no_speech_threshold=0.6, logprob_threshold=-1.0, word_timestamps=False, on_segment=None):
+    """
+    Transcribe only the voiced parts of a song: the VAD pass drops silent stretches, the remaining
+    windows are decoded in batches and their segments are shifted back to song time.
+
+    Args:
+        model (whisper.model.Whisper): Loaded model.
+        samples (np.ndarray): Mono float32 samples at 16 kHz.
+        batch_size (int): Windows per whisper.decode call.
+        fp16 (bool): Decode in half precision (the layers cast their float32 weights).
+        language (str): Language code, detected on the first window when None.
+        no_speech_threshold (float): Windows more likely silent than this (and with a low log-probability) are dropped.
+        logprob_threshold (float): Average log-probability below which a likely-silent window is dropped.
+        word_timestamps (bool): Align the words of every window with the model's cross-attention.
+        on_segment (callable): Called with each segment once its batch is decoded.
+    Returns:
+        dict: 'text', 'segments' and 'language' like model.transcribe, plus 'vad' statistics.
+    """
+    sr = whisper.audio.SAMPLE_RATE
+    windows = plan_windows(voiced_regions(samples, sr), sr)
+    voiced_seconds = sum(end - start for start, end in windows) / sr
+    print(f"VAD: {len(windows)} window(s), {voiced_seconds:.1f}s of {len(samples) / sr:.1f}s voiced")
+
+    def mels(batch):
+        return torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(samples[start:end])), n_mels=model.dims.n_mels)
+            for start, end in batch
+        ]).to(model.device)
+
+    if windows and language is None:
+        _, probs = model.detect_language(mels(windows[:1]).to(torch.float16 if fp16 else torch.float32))
+        language = max(probs[0], key=probs[0].get)
+    tokenizer = whisper.tokenizer.get_tokenizer(model.is_multilingual, num_languages=model.num_languages,
+                                                language=language, task="transcribe")
+    options = whisper.DecodingOptions(language=language, task="transcribe", without_timestamps=False, fp16=fp16)
+
+    segments = []
+    last_speech = 0.0
+    for first in range(0, len(windows), batch_size):
+        batch = windows[first:first + batch_size]
+        mel_batch = mels(batch)
+        for index, ((start, end), result) in enumerate(zip(batch, whisper.decode(model, mel_batch, options))):
+            if result.no_speech_prob > no_speech_threshold and result.avg_logprob < logprob_threshold:
+                continue
+            offset = start / sr
+            window_segments = [{'id': len(segments) + i, 'seek': start // whisper.audio.HOP_LENGTH,
+                                'start': offset + seg_start, 'end': offset + min(seg_end, (end - start) / sr),
+                                'text': text, 'tokens': tokens, 'avg_logprob': result.avg_logprob,
+                                'no_speech_prob': result.no_speech_prob}
+                               for i, (seg_start, seg_end, text, tokens)
+                               in enumerate(_parse_timestamped(result.tokens, tokenizer, (end - start) / sr))]
+            if word_timestamps and window_segments:
+                # whisper's own aligner; 'seek' (the window start in mel frames) puts the words in song time
+                mel = mel_batch[index].to(torch.float16 if fp16 else torch.float32)
+                whisper.timing.add_word_timestamps(segments=window_segments, model=model, tokenizer=tokenizer, mel=mel,
+                                                   num_frames=(end - start) // whisper.audio.HOP_LENGTH,
+                                                   last_speech_timestamp=last_speech)
+                words = [word for segment in window_segments for word in segment.get('words', [])]
+                if words:
+                    last_speech = words[-1]['end']
+            for segment in window_segments:
+                segments.append(segment)
+                if on_segment is not None:
+                    on_segment(segment)
+
+    return {'text': "".join(segment['text'] for segment in segments), 'segments': segments, 'language': language,
+            'vad': {'windows': len(windows), 'voiced_seconds': voiced_seconds, 'total_seconds': len(samples) / sr}}
+
 def save_segments_to_file(segments, file_path):
     """
     Save transcription segments to a file, matching the command-line tool's format.
@@ -22,7 +317,4 @@ def save_segments_to_file(segments, file_path):
     """
     with open(file_path, "w", encoding="utf-8") as f:
         for segment in segments:
-            start = segment['start']
-            end = segment['end']
-            text = segment['text']
-            f.write(f"[{start:.2f} --> {end:.2f}] {text}\n")
+            f.write(text_line(segment))